@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+import math
+import threading
+import time
+from functools import wraps
+from flask import Response, jsonify, make_response, request
+
+REASONS = ('queue_full', 'timeout')
+
+
+class Group(object):
+    """ The concurrency limit and wait queue shared by a group of views """
+
+    def __init__(self, name, concurrency, queue, wait):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.wait = wait
+        self.condition = threading.Condition(threading.Lock())
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = dict((reason, 0) for reason in REASONS)
+
+    def acquire(self):
+        """ Waits for a free slot until the group's deadline
+
+        Returns:
+            None once a slot is held, or the reason the request was shed
+        """
+        with self.condition:
+            if self.active >= self.concurrency:
+                if self.waiting >= self.queue:
+                    self.shed['queue_full'] += 1
+                    return 'queue_full'
+                self.waiting += 1
+                self.queued += 1
+                deadline = time.time() + self.wait
+                try:
+                    while self.active >= self.concurrency:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.shed['timeout'] += 1
+                            return 'timeout'
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            return None
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def retryAfter(self):
+        return max(1, int(math.ceil(self.wait)))
+
+    def stats(self):
+        with self.condition:
+            return {'concurrency': self.concurrency,
+                    'queue': self.queue,
+                    'wait': self.wait,
+                    'active': self.active,
+                    'waiting': self.waiting,
+                    'admitted': self.admitted,
+                    'queued': self.queued,
+                    'shed': dict(self.shed)}
+
+
+def parseLimits(text):
+    """ Reads limit overrides such as "export=1:2:1.0,search=4:8:0.5"
+
+    Args:
+        text: comma separated group=concurrency:queue:wait entries
+
+    Returns:
+        A dict of group names to (concurrency, queue, wait) tuples
+    """
+    limits = {}
+    for entry in (text or '').split(','):
+        if not entry.strip():
+            continue
+        name, values = entry.split('=', 1)
+        concurrency, queue, wait = values.split(':')
+        limits[name.strip()] = (int(concurrency), int(queue), float(wait))
+    return limits
+
+
+class AdmissionControl(object):
+    """ Caps the requests each group of views handles at once
+
+    A view joins a group with the limit decorator, declared under its
+    route. At most concurrency requests of a group run at the same time in
+    a process. Up to queue more wait for a slot for at most wait seconds,
+    and any others, or a waiter whose time runs out, get a 503 with a
+    Retry-After header straight away. An expensive path that is flooded
+    then only ties up its own share of the worker's threads and the cheap
+    pages keep being served. A generated, streamed response holds its slot
+    until it is closed, so it counts for as long as it streams.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.groups = {}
+
+    def configure(self, enabled, limits):
+        """ Applies the settings read by create_app
+
+        Args:
+            enabled: False to admit every request
+            limits: a dict of group names to (concurrency, queue, wait)
+            tuples that override the limits declared on the views
+        """
+        self.enabled = enabled
+        for name, (concurrency, queue, wait) in limits.items():
+            if name not in self.groups:
+                raise ValueError('Unknown admission group %s' % name)
+            group = self.groups[name]
+            group.concurrency, group.queue, group.wait = \
+                concurrency, queue, wait
+
+    def limit(self, name, concurrency, queue=0, wait=1.0):
+        """ Decorates a view so it is admitted through a group's limit
+
+        Views that name the same group share its limit; the limits of the
+        first declaration are used.
+
+        Args:
+            name: the name of the group
+            concurrency: how many requests of the group may run at once
+            queue: how many more may wait for a slot
+            wait: the longest a request waits, in seconds
+
+        Returns:
+            The decorator
+        """
+        group = self.groups.setdefault(
+            name, Group(name, concurrency, queue, wait))
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                if not self.enabled:
+                    return view(**kwargs)
+                if group.acquire() is not None:
+                    return self.busy(group)
+                try:
+                    response = make_response(view(**kwargs))
+                except Exception:
+                    group.release()
+                    raise
+                # Passthrough bodies, such as files, skip the close hooks
+                if response.is_streamed and not response.direct_passthrough:
+                    response.call_on_close(group.release)
+                else:
+                    group.release()
+                return response
+            return wrapper
+        return decorator
+
+    def busy(self, group):
+        """ Builds the 503 sent to a shed request, as JSON for the API """
+        message = 'The catalog is busy, please try again shortly'
+        if request.is_json or request.path.endswith('.json'):
+            response = jsonify(error=message)
+            response.status_code = 503
+        else:
+            response = Response(message + '\n', 503, mimetype='text/plain')
+        response.headers['Retry-After'] = str(group.retryAfter())
+        return response
+
+    def stats(self):
+        """ Gets the limits, queue depth and shed counts of every group
+
+        Returns:
+            A dict of group names to dicts of their counters
+        """
+        return dict((name, group.stats())
+                    for name, group in self.groups.items())
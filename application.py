@@ -1,31 +1,298 @@
 #!/usr/bin/env python
-from sqlalchemy import create_engine, desc
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import desc
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import subqueryload
 from sqlalchemy.orm.exc import NoResultFound
+from admission import AdmissionControl, parseLimits
 from database_setup import Category, Base, Item, User
+from db import DBSession, createEngines, session, useReader, useWriter
+from assets import StaticAssets
+from batch_writes import KeyReused, KEY_LENGTH, applyBatch, fingerprint
+from batch_writes import rememberResponse, storedResponse
+from catalog_export import iterCatalogJSON
+from catalog_version import CatalogVersion, categoryScope, itemScope
+from category_cache import CategoryCache
+from config import loadConfig
+from change_feed import ChangeFeed, serverSentEvents
+from change_log import ChangeLog
+from compression import Compression
+from item_counts import adjustItemCounts, itemCount
+from item_lookup import lookupItems, requestedIds
+from pagination import keysetPage, pageCursor, pageSize
+from profiling import RequestProfiler
+from read_model import ReadModel
+from search import ensureSearchIndex, searchItems
+from snapshot import CatalogSnapshot
+from write_queue import WriteQueue
+from metrics import Metrics
+from page_cache import (PageCache, createBackend, catalogKey, categoryKey,
+                        itemKey)
+from page_cache import firstPageKey
 from flask import session as login_session
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.client import FlowExchangeError
-import requests
-import httplib2
+from google_auth import GoogleAuth
 import json
+import logging
+import os
 import random
 import string
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response
+import time
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, abort
+from flask import Response, stream_with_context
+from flask.logging import default_handler
+from jinja2 import FileSystemBytecodeCache
 
 
 app = Flask(__name__)
-
-CLIENT_ID = json.loads(open('client_secrets.json',
-                            'r').read())['web']['client_id']
 APPLICATION_NAME = "Catalog Application"
 
-engine = create_engine('sqlite:///catalogwithusers.db',
-                       connect_args={'check_same_thread': False})
-Base.metadata.bind = engine
+# Everything below is set up by create_app, not at import time, so that a
+# preforking server can import the module before it configures anything.
+engine = None
+readEngine = None
+googleAuth = None
+fullTextSearch = True
+changeFeed = ChangeFeed()
+changeLog = ChangeLog()
+versions = CatalogVersion()
+categoryCache = CategoryCache()
+categoryCache.listen(DBSession)
+pageCache = PageCache(versions=versions)
+metrics = Metrics()
+staticAssets = StaticAssets()
+snapshot = CatalogSnapshot()
+compression = Compression()
+admission = AdmissionControl()
+readModel = ReadModel()
+profiler = RequestProfiler()
+writeQueue = WriteQueue()
+metrics.gauge('catalog_page_cache_lookups_total',
+              'Anonymous page cache lookups by result.',
+              lambda: dict(((('result', result),), count)
+                           for result, count in pageCache.stats().items()
+                           if result != 'backend'),
+              kind='counter')
+metrics.gauge('catalog_change_feed_sequence',
+              'Id of the newest item change in this process.',
+              lambda: {(): changeFeed.sequence})
+metrics.gauge('catalog_admission_active',
+              'Requests running in each admission group.',
+              lambda: dict(((('group', name),), stats['active']) for name,
+                           stats in admission.stats().items()))
+metrics.gauge('catalog_admission_waiting',
+              'Requests queued for a slot in each admission group.',
+              lambda: dict(((('group', name),), stats['waiting']) for name,
+                           stats in admission.stats().items()))
+metrics.gauge('catalog_admission_shed_total',
+              'Requests answered with 503 by each admission group.',
+              lambda: dict(((('group', name), ('reason', reason)), count)
+                           for name, stats in admission.stats().items()
+                           for reason, count in stats['shed'].items()),
+              kind='counter')
+metrics.gauge('catalog_write_groups_total',
+              'Transactions committed by the write queue.',
+              lambda: {(): writeQueue.batches}, kind='counter')
+metrics.gauge('catalog_write_queue_writes_total',
+              'Writes committed by the write queue.',
+              lambda: {(): writeQueue.writes}, kind='counter')
+
+
+def create_app(config=None):
+    """ Configures the application, its database and its caches
+
+    Settings come from the environment (see config.loadConfig) and can be
+    overridden by the config argument. The application is only set up
+    once per process; later calls return it unchanged.
+
+    Args:
+        config: a dict of Flask config keys that override the environment
+
+    Returns:
+        The Flask application
+    """
+    global engine, readEngine, googleAuth, fullTextSearch
+    if engine is not None:
+        return app
+    app.config.update(loadConfig())
+    app.config.update(config or {})
+    configureLogging(app.config['LOG_LEVEL'])
+    if not app.config['SECRET_KEY']:
+        app.logger.warning(
+            'SECRET_KEY is not set, sessions will not survive a restart')
+        app.config['SECRET_KEY'] = os.urandom(24)
+    if app.config['TEMPLATE_BYTECODE_CACHE']:
+        cache_dir = app.config['TEMPLATE_CACHE_DIR']
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    engine, readEngine = createEngines(app.config['DATABASE_URL'],
+                                       app.config['DATABASE_READ_URL'])
+    Base.metadata.bind = engine
+    DBSession.configure(writer=engine, reader=readEngine)
+    Base.metadata.create_all(engine)
+    fullTextSearch = ensureSearchIndex(engine)
+
+    googleAuth = GoogleAuth(
+        app.config['GOOGLE_CLIENT_SECRETS'],
+        token_uri=app.config['GOOGLE_TOKEN_URI'],
+        tokeninfo_uri=app.config['GOOGLE_TOKENINFO_URI'],
+        userinfo_uri=app.config['GOOGLE_USERINFO_URI'],
+        revoke_uri=app.config['GOOGLE_REVOKE_URI'],
+        certs_uri=app.config['GOOGLE_CERTS_URI'],
+        timeout=app.config['GOOGLE_HTTP_TIMEOUT'],
+        verify_id_token=app.config['GOOGLE_VERIFY_ID_TOKEN'])
+    changeLog.check_seconds = app.config['CHANGE_LOG_CHECK_SECONDS']
+    changeLog.size = app.config['CHANGE_LOG_SIZE']
+    changeLog.init_app(engine, readEngine)
+    versions.lag = changeLog.check_seconds
+    versions.reset(changeLog.seen, changeLog.epoch)
+    changeFeed.resize(app.config['CHANGE_FEED_SIZE'])
+    changeFeed.restart(changeLog.seen)
+    categoryCache.ttl = app.config['CATEGORY_CACHE_TTL']
+    pageCache.backend = createBackend(app.config['PAGE_CACHE_BACKEND'],
+                                      size=app.config['PAGE_CACHE_SIZE'],
+                                      ttl=app.config['PAGE_CACHE_TTL'],
+                                      redis_url=app.config['REDIS_URL'])
+    metrics.slow_query_seconds = app.config['SLOW_QUERY_SECONDS']
+    metrics.query_count_header = app.config['QUERY_COUNT_HEADER']
+    metrics.init_app(app, engine, readEngine)
+    staticAssets.min_size = compression.min_size = \
+        app.config['COMPRESS_MIN_SIZE']
+    staticAssets.init_app(app)
+    compression.gzip_level = app.config['COMPRESS_GZIP_LEVEL']
+    compression.brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+    compression.init_app(app)
+    # Change feed clients hold their connection open, so their group is
+    # sized by its own setting rather than like the short requests
+    limits = {'changes': (app.config['CHANGE_FEED_CONNECTIONS'], 0, 0)}
+    limits.update(parseLimits(app.config['ADMISSION_LIMITS']))
+    admission.configure(app.config['ADMISSION_CONTROL'], limits)
+    if app.config['SNAPSHOT_DIR']:
+        snapshot.directory = app.config['SNAPSHOT_DIR']
+        snapshot.use_msgpack = snapshot.use_msgpack and \
+            app.config['SNAPSHOT_MSGPACK']
+        snapshot.delay = app.config['SNAPSHOT_DELAY']
+        snapshot.init_app(app, DBSession)
+    if app.config['READ_MODEL']:
+        readModel.reload_seconds = app.config['READ_MODEL_RELOAD_SECONDS']
+        readModel.init_app(app, session)
+    if app.config['WRITE_QUEUE']:
+        writeQueue.window = app.config['WRITE_QUEUE_WINDOW']
+        writeQueue.max_batch = app.config['WRITE_QUEUE_MAX_BATCH']
+        writeQueue.start(DBSession)
+    profiler.directory = app.config['PROFILE_DIR']
+    profiler.sample_rate = app.config['PROFILE_SAMPLE_RATE']
+    profiler.token = app.config['PROFILE_TOKEN']
+    profiler.max_files = app.config['PROFILE_MAX_FILES']
+    profiler.init_app(app)
+    if app.config['WARM_UP']:
+        # Compiled in the gunicorn master, the templates are shared by
+        # every forked worker
+        compileTemplates()
+    return app
+
+
+def configureLogging(level):
+    """ Gives the catalog.* loggers somewhere to write to
+
+    The slow query log and the background snapshot, read model and write
+    queue threads log under catalog. Unless logging was configured by
+    whoever runs the app, they share the handlers of gunicorn's error log
+    under gunicorn and Flask's default handler, which writes to stderr,
+    otherwise.
+
+    Args:
+        level: the lowest level logged, such as 'INFO'
+    """
+    log = logging.getLogger('catalog')
+    log.setLevel(level.upper())
+    if log.handlers or logging.getLogger().handlers:
+        return
+    for handler in logging.getLogger('gunicorn.error').handlers or \
+            [default_handler]:
+        log.addHandler(handler)
+
+
+def compileTemplates():
+    """ Loads every template so no request waits for one to compile
+
+    Returns:
+        The number of templates loaded
+    """
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def primePool(connections=None):
+    """ Opens database connections ahead of the first requests
+
+    Args:
+        connections: how many connections each engine opens, defaults to
+        the size of its pool
+
+    Returns:
+        The number of connections opened
+    """
+    opened = 0
+    for pooled in set([engine, readEngine]):
+        if pooled is None:
+            continue
+        count = connections or getattr(pooled.pool, 'size', lambda: 1)()
+        checked_out = []
+        try:
+            for _ in range(count):
+                connection = pooled.connect()
+                connection.scalar('SELECT 1')
+                checked_out.append(connection)
+        finally:
+            for connection in checked_out:
+                connection.close()
+        opened += len(checked_out)
+    return opened
+
+
+def warmUp():
+    """ Readies a worker before it accepts traffic
+
+    The templates are compiled, the connection pools are filled and the
+    category cache is loaded, so the first requests cost what later ones do.
 
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+    Returns:
+        A dict of what was done and how long it took in seconds
+    """
+    started = time.time()
+    templates = compileTemplates()
+    connections = primePool(app.config['WARM_UP_CONNECTIONS'])
+    try:
+        categoryCache.get(session)
+    finally:
+        session.remove()
+    seconds = time.time() - started
+    app.logger.info('warmed up %d templates and %d connections in %.3fs',
+                    templates, connections, seconds)
+    return {'templates': templates, 'connections': connections,
+            'seconds': seconds}
+
+
+def beforeFork():
+    """ Closes pooled connections so no child process inherits them """
+    if engine is not None:
+        engine.dispose()
+        readEngine.dispose()
+
+
+def afterFork():
+    """ Resets the per-process state of a freshly forked worker
+
+    The pool is emptied again so the worker opens its own connections and
+    the random generator behind login state tokens is reseeded so workers
+    do not share a sequence. The catalog versions are kept: they come from
+    the change log, which every worker follows.
+    """
+    beforeFork()
+    random.seed()
 
 
 def createUser(login_session):
@@ -37,13 +304,16 @@ def createUser(login_session):
     Returns:
         user.id: a unique integer value that identifies the user
     """
-    newUser = User(name=login_session['username'],
-                   email=login_session['email'],
-                   picture=login_session['picture'])
-    session.add(newUser)
-    session.commit()
-    user = session.query(User).filter_by(email=login_session['email']).one()
-    return user.id
+    name = login_session['username']
+    email = login_session['email']
+    picture = login_session['picture']
+
+    def create(write_session):
+        newUser = User(name=name, email=email, picture=picture)
+        write_session.add(newUser)
+        write_session.flush()
+        return newUser.id
+    return runWrite(create)
 
 
 def getUserInfo(user_id):
@@ -76,32 +346,431 @@ def getUserID(email):
         return None
 
 
+# Views whose writes all go through runWrite
+QUEUED_WRITES = ('addNewItem', 'editItem', 'deleteItem', 'gconnect')
+
+
+@app.before_request
+def routeSession():
+    """ Sends the queries of requests that change data to the write engine
+
+    GET and HEAD requests only read, so they are served by the read engine.
+    The others go back to it once runWrite has committed their write.
+    With the write queue on, the views that hand their writes to it only
+    read themselves, and must not hold the write lock the writer thread
+    is waiting for.
+    """
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and not (
+            writeQueue.enabled and request.endpoint in QUEUED_WRITES):
+        useWriter()
+
+
+def runWrite(work):
+    """ Runs a write in a transaction of its own and commits it
+
+    With WRITE_QUEUE on, the write is handed to the writer thread, which
+    commits it together with the writes that arrive within
+    WRITE_QUEUE_WINDOW seconds of it. Otherwise it runs on the request's
+    session. Either way the request only goes on once the write is
+    committed.
+
+    Args:
+        work: a function that takes a session, makes its changes without
+        committing them and returns a result
+
+    Returns:
+        What work returned; what work or the commit raised is raised
+    """
+    if writeQueue.enabled:
+        # Ends the request's read transaction, which would keep an SQLite
+        # file that is not in WAL mode from committing
+        session.rollback()
+        return writeQueue.submit(work)
+    result = work(session)
+    session.commit()
+    useReader()
+    return result
+
+
+@app.before_request
+def catchUp():
+    """ Applies the writes of every process before a read is answered
+
+    The change log is read at most every CHANGE_LOG_CHECK_SECONDS, so a
+    write made by another worker moves the versions on and drops the
+    cached pages here within that time.
+    """
+    if request.method in ('GET', 'HEAD'):
+        changeLog.catchUp(applyChanges)
+
+
+@app.teardown_appcontext
+def removeSession(exception=None):
+    """ Rolls back anything uncommitted and releases the request's session """
+    session.remove()
+
+
+def itemChanged(action, item, old_category_id=None):
+    """ Publishes a committed write to an item to the caches and feed
+
+    Args:
+        action: 'create', 'edit' or 'delete'
+        item: the Item that was written
+        old_category_id: the id of the item's category before an edit
+    """
+    itemsChanged([(action, item, old_category_id)])
+
+
+def itemsChanged(changes):
+    """ Publishes the committed writes of one transaction together
+
+    The writes are read back from the change log, after any that other
+    processes committed before them, and applied by applyChanges.
+
+    Args:
+        changes: a list of (action, item, old_category_id) tuples, as taken
+        by itemChanged
+    """
+    changeLog.catchUp(applyChanges, wait=True)
+    if snapshot.directory:
+        snapshot.markDirty()
+
+
+def applyChanges(changes, complete):
+    """ Brings this process up to date with the change log
+
+    Each change, whether this process or another one wrote it, moves on
+    the versions and drops the cached pages of its item and categories,
+    updates the read model and is published to the change feed. When
+    changes were lost to pruning or items were written without being
+    logged, or the read model is due to be loaded again, every version and
+    cached page is dropped instead.
+
+    Args:
+        changes: a list of CatalogChange rows in id order
+        complete: False when the log was pruned past the last change seen
+        or its epoch was replaced
+    """
+    if not complete:
+        position = changes[-1].id if changes else changeLog.seen
+        versions.reset(position, changeLog.epoch)
+        pageCache.clear()
+        if readModel.enabled:
+            readModel.reload(session)
+        changeFeed.restart(position)
+        return
+    if readModel.enabled and readModel.expired():
+        versions.reset(changeLog.seen)
+        pageCache.clear()
+        readModel.reload(session)
+    elif readModel.enabled and changes:
+        readModel.apply(session, changes)
+    if not changes:
+        return
+    names = categoryCache.get(session).names
+    keys = set([catalogKey()])
+    for change in changes:
+        category_names = set(names[category_id] for category_id in
+                             (change.category_id, change.old_category_id)
+                             if category_id in names)
+        versions.bump(change.id, categories=category_names,
+                      items=[change.item_id])
+        keys.add(itemKey(change.item_id))
+        keys.update(categoryKey(name) for name in category_names)
+    pageCache.evict(*keys)
+    for change in changes:
+        changeFeed.publish(change.id, change.action, dict(
+            change.serialize, category_name=names.get(change.category_id)))
+
+
+def loadLatestItems(count):
+    """ Queries the newest items for the front page
+
+    Args:
+        count: the number of items to load
+
+    Returns:
+        A list of serialized items including their category_name
+    """
+    rows = session.query(Item.id, Item.name, Item.description,
+                         Item.category_id, Category.name) \
+        .join(Category).order_by(desc(Item.id)).limit(count)
+    return [{'item_id': item_id,
+             'item_name': name,
+             'item_description': description,
+             'category_id': category_id,
+             'category_name': category_name}
+            for item_id, name, description, category_id, category_name
+            in rows]
+
+
 # Displays the front page of the catalog web app
 @app.route('/')
 @app.route('/catalog/')
+@versions.conditional(personal=True)
+@pageCache.cached(catalogKey)
 def catalogDisplay():
-    categories = session.query(Category).order_by(Category.name).all()
-    items = session.query(Item).join(Category).order_by(desc(Item.id)).limit(5)
+    if readModel.enabled:
+        model = readModel.current()
+        categories = model.categories.categories
+        latest = model.latestItems(changeFeed.latest_size)
+    else:
+        categories = categoryCache.get(session).categories
+        latest = changeFeed.latestItems(loadLatestItems)
     return render_template('catalog.html',
                            categories=categories,
-                           lastestItems=items)
+                           lastestItems=latest)
 
 
 # Displays all the catalog items as a JSON object
 @app.route('/catalog.json')
+@admission.limit('export', concurrency=2, queue=2, wait=2.0)
 def getJSONEndpointAll():
-    categories = session.query(Category).all()
+    response = sendSnapshot('json')
+    return response if response is not None else exportCatalogJSON()
+
+
+# Displays all the catalog items as a MessagePack document
+@app.route('/catalog.msgpack')
+@admission.limit('export', concurrency=2, queue=2, wait=2.0)
+def getMsgpackEndpointAll():
+    response = sendSnapshot('msgpack')
+    return response if response is not None else abort(404)
+
+
+def sendSnapshot(extension):
+    """ Sends the catalog snapshot, refreshing it if it fell behind
+
+    Args:
+        extension: 'json' or 'msgpack'
+
+    Returns:
+        A response, or None when there is no snapshot to send
+    """
+    if not snapshot.directory:
+        return None
+    snapshot.catchUp(changeLog.seen, changeLog.epoch)
+    return snapshot.send(extension)
+
+
+@versions.conditional()
+def exportCatalogJSON():
+    """ Builds /catalog.json from the database when there is no snapshot """
+    if readModel.enabled:
+        return Response(readModel.current().iterCatalogJSON(),
+                        mimetype=app.config['JSONIFY_MIMETYPE'])
+    if app.config['CATALOG_JSON_STREAMING']:
+        chunks = iterCatalogJSON(session,
+                                 app.config['CATALOG_JSON_BATCH_SIZE'])
+        return Response(stream_with_context(chunks),
+                        mimetype=app.config['JSONIFY_MIMETYPE'])
+    categories = session.query(Category).options(
+        subqueryload(Category.items)).all()
     return jsonify(category=[c.serialize for c in categories])
 
 
+# Displays a page of all the catalog items as a JSON object
+@app.route('/catalog/items.json')
+@versions.conditional()
+def getJSONItems():
+    return itemsPage(session.query(Item), 'getJSONItems')
+
+
+# Displays a page of the items in a category as a JSON object
+@app.route('/catalog/<category_name>/items.json')
+@versions.conditional(categoryScope)
+def getJSONCategoryItems(category_name):
+    category_id = categoryCache.get(session).ids.get(category_name)
+    if category_id is None:
+        return jsonify(error='No category with that name exists'), 404
+    return itemsPage(session.query(Item).filter(
+        Item.category_id == category_id), 'getJSONCategoryItems',
+        category_id, category_name=category_name)
+
+
+def itemsPage(query, endpoint, category_id=None, **values):
+    """ Answers a paged JSON listing of items
+
+    The page is chosen with the after or before query arguments, which are
+    item ids, and its size with limit.
+
+    Args:
+        query: the query of the items to list
+        endpoint: the view of the listing, for the page links
+        category_id: the category listed, or None for every item
+        values: the other arguments of the view
+
+    Returns:
+        A JSON response with the items, the total and the page links
+    """
+    try:
+        after, before = pageCursor(request.args)
+    except ValueError:
+        return jsonify(error='after and before must be item ids'), 400
+    size = pageSize(request.args, app.config['PAGE_SIZE'],
+                    app.config['MAX_PAGE_SIZE'])
+    page = keysetPage(query, Item.id, size, after, before)
+    return jsonify(
+        items=[item.serialize for item in page.items],
+        total=itemCount(session, category_id),
+        prev=url_for(endpoint, before=page.before, limit=size, **values)
+        if page.before is not None else None,
+        next=url_for(endpoint, after=page.after, limit=size, **values)
+        if page.after is not None else None)
+
+
 # Displays a specific catalog item as a JSON object
 @app.route('/item_<item_id>.json')
+@versions.conditional(itemScope)
 def getJSONEndpointSpecificItem(item_id):
+    if readModel.enabled:
+        item = readModel.current().item(item_id)
+        if item is None:
+            return jsonify(
+                error='No item with that id exists in the catalog'), 404
+        return jsonify(item=item.serialize)
     try:
         item = session.query(Item).filter_by(id=item_id).one()
         return jsonify(item=item.serialize)
     except NoResultFound:
-        return "{'error': 'No item with that id exists in the catalog'}"
+        return jsonify(error='No item with that id exists in the catalog'), 404
+
+
+# Displays many catalog items, with their category and owner, as JSON
+@app.route('/items.json')
+@versions.conditional()
+def getJSONItemsById():
+    """ Looks up the items listed in the ids query argument at once
+
+    Returns:
+        A JSON object whose items list has one entry per requested id, in
+        request order. Ids that do not exist get {"item_id": id,
+        "error": "not_found"}.
+    """
+    try:
+        item_ids = requestedIds(request.args, app.config['MULTI_GET_MAX_IDS'])
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    return jsonify(items=lookupItems(session, item_ids))
+
+
+# Displays the request, SQL and cache metrics of this process
+@app.route('/metrics')
+def getMetrics():
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+# Displays the page cache hit and miss counters of this process
+@app.route('/page_cache.json')
+def getPageCacheStats():
+    return jsonify(pageCache.stats())
+
+
+# Displays the admission limits, queue depths and shed counts of this process
+@app.route('/admission.json')
+def getAdmissionStats():
+    return jsonify(admission.stats())
+
+
+def searchResults():
+    """ Runs the search described by the request's query string
+
+    Returns:
+        A (terms, page, items, has_next) tuple where items is a list of
+        serialized items that also carry their category name
+    """
+    terms = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 50)
+    rows, has_next = searchItems(session, terms, page, per_page,
+                                 full_text=fullTextSearch)
+    category_names = categoryCache.get(session).names
+    items = [{'item_id': item_id,
+              'item_name': name,
+              'item_description': description,
+              'category_id': category_id,
+              'category_name': category_names.get(category_id)}
+             for item_id, name, description, category_id in rows]
+    return terms, page, items, has_next
+
+
+# Searches the names and descriptions of the catalog items
+@app.route('/search')
+@admission.limit('search', concurrency=2, queue=2, wait=1.0)
+def searchCatalog():
+    terms, page, items, has_next = searchResults()
+    return render_template('search.html',
+                           terms=terms,
+                           page=page,
+                           items=items,
+                           has_next=has_next)
+
+
+# Searches the catalog items and returns a page of results as JSON
+@app.route('/search.json')
+@admission.limit('search', concurrency=2, queue=2, wait=1.0)
+def getJSONEndpointSearch():
+    terms, page, items, has_next = searchResults()
+    return jsonify(items=items,
+                   page=page,
+                   next_page=page + 1 if has_next else None)
+
+
+def changeCursor():
+    """ Gets the change feed cursor sent by the client
+
+    Returns:
+        The id of the last change the client has seen, from the since
+        parameter or the Last-Event-ID header of a reconnecting
+        EventSource, defaulting to the newest change
+    """
+    cursor = request.args.get('since', request.headers.get('Last-Event-ID'))
+    try:
+        return int(cursor)
+    except (TypeError, ValueError):
+        return changeFeed.sequence
+
+
+def pollChanges():
+    """ Reads the change log while a change feed client waits
+
+    Other workers' writes reach the feed of this one only through the
+    log, so waiting clients read it every CHANGE_LOG_CHECK_SECONDS.
+    """
+    try:
+        changeLog.catchUp(applyChanges)
+    finally:
+        session.remove()
+
+
+# Streams item creates, edits and deletes as Server-Sent Events
+@app.route('/catalog/changes')
+@admission.limit('changes', concurrency=16)
+def streamChanges():
+    events = serverSentEvents(changeFeed, changeCursor(),
+                              app.config['CHANGE_FEED_STREAM_SECONDS'],
+                              poll=pollChanges)
+    response = Response(events, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Long-polls for item changes and returns them as JSON
+@app.route('/catalog/changes.json')
+@admission.limit('changes', concurrency=16)
+def getJSONEndpointChanges():
+    timeout = min(max(request.args.get('timeout', 25, type=float), 0), 30)
+    since = changeCursor()
+    events, reset = changeFeed.wait(since, timeout, poll=pollChanges)
+    if events:
+        cursor = events[-1]['id']
+    elif reset:
+        cursor = changeFeed.sequence
+    else:
+        cursor = max(since, changeFeed.sequence)
+    return jsonify(events=events, cursor=cursor, reset=reset)
 
 
 # Adds a new item to the catalog if logged in
@@ -119,19 +788,118 @@ def addNewItem():
         return redirect(url_for('showLogin'))
     if request.method == 'POST':
         if request.form['item-name']:
-            newItem = Item(name=request.form['item-name'],
-                           description=request.form['item-description'],
-                           category_id=request.form['categories-list'],
-                           user_id=login_session['user_id'])
-            session.add(newItem)
+            name = request.form['item-name']
+            description = request.form['item-description']
+            category_id = formCategoryId(request.form['categories-list'])
+            user_id = login_session['user_id']
+
+            def create(write_session):
+                newItem = Item(name=name, description=description,
+                               category_id=category_id, user_id=user_id)
+                write_session.add(newItem)
+                changes = [('create', newItem, None)]
+                adjustItemCounts(write_session, changes)
+                changeLog.record(write_session, changes)
+                return newItem
+            newItem = runWrite(create)
             flash('%s has been added to the catalog!' % newItem.name)
-            session.commit()
+            itemChanged('create', newItem)
             return redirect(url_for('catalogDisplay'))
     else:
-        categories = session.query(Category).order_by(Category.name).all()
+        categories = categoryCache.get(session).categories
         return render_template('new-item-form.html', categories=categories)
 
 
+# Creates, updates and deletes many items in one transaction
+@app.route('/catalog/items/batch', methods=['POST'])
+@admission.limit('batch', concurrency=1, queue=2, wait=5.0)
+def batchItems():
+    """ Applies a JSON batch of item writes for the logged in user
+
+    The body is {"operations": [...]} where each operation is one of
+    {"op": "create", "name", "description", "category_id"},
+    {"op": "update", "item_id", and any of those fields} or
+    {"op": "delete", "item_id"}. Either every operation is applied or none
+    is. A batch sent again with the same Idempotency-Key header gets the
+    first response back instead of being applied twice.
+
+    Returns:
+        on success: the result of every operation with the item ids
+        422 with the error of each rejected operation if any is invalid
+        401 when user is not signed in
+    """
+    if 'username' not in login_session:
+        return jsonify(error='You need to be logged in to change items'), 401
+    body = request.get_json(silent=True)
+    operations = body.get('operations') if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify(error='Send a non-empty list of operations'), 400
+    if len(operations) > app.config['BATCH_MAX_OPERATIONS']:
+        return jsonify(error='A batch can have at most %d operations'
+                       % app.config['BATCH_MAX_OPERATIONS']), 400
+    key = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= KEY_LENGTH:
+        return jsonify(error='Idempotency-Key must be 1 to %d characters'
+                       % KEY_LENGTH), 400
+    user_id = login_session['user_id']
+    digest = fingerprint(operations)
+    ttl = app.config['IDEMPOTENCY_KEY_TTL']
+    try:
+        if key is not None:
+            stored = storedResponse(session, user_id, key, digest, ttl)
+            if stored is not None:
+                return replayedBatch(stored)
+        results, changes = applyBatch(session, user_id, operations,
+                                      categoryCache.get(session).names)
+        if not changes:
+            session.rollback()
+            return jsonify(results=results), 422
+        adjustItemCounts(session, changes)
+        changeLog.record(session, changes)
+        response = {'results': results}
+        if key is not None:
+            rememberResponse(session, user_id, key, digest, response, ttl)
+        try:
+            session.commit()
+            useReader()
+        except IntegrityError:
+            # Another request with the same key committed first
+            session.rollback()
+            useReader()
+            stored = key and storedResponse(session, user_id, key, digest, ttl)
+            if not stored:
+                raise
+            return replayedBatch(stored)
+    except KeyReused:
+        return jsonify(error='Idempotency-Key was used for another batch'), 422
+    itemsChanged(changes)
+    return jsonify(response)
+
+
+def replayedBatch(stored):
+    response = jsonify(stored)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def formCategoryId(value):
+    """ Checks the category chosen in an item form
+
+    Args:
+        value: the categories-list form value
+
+    Returns:
+        The id of an existing category; anything else is answered with 400
+    """
+    try:
+        category_id = int(value)
+    except ValueError:
+        abort(400, 'Choose one of the categories')
+    if category_id not in categoryCache.get(session).names:
+        abort(400, 'Choose one of the categories')
+    return category_id
+
+
 # Deletes an item from the catalog if logged in
 @app.route('/catalog/delete/<item_id>', methods=['GET', 'POST'])
 def deleteItem(item_id):
@@ -157,8 +925,15 @@ def deleteItem(item_id):
         alert += "</script><body onload='myFunction()'>"
         return alert
     if request.method == 'POST':
-        session.delete(item)
-        session.commit()
+        def delete(write_session):
+            item = write_session.query(Item).filter_by(id=item_id).one()
+            write_session.delete(item)
+            changes = [('delete', item, None)]
+            adjustItemCounts(write_session, changes)
+            changeLog.record(write_session, changes)
+            return item
+        item = runWrite(delete)
+        itemChanged('delete', item)
         flash('%s has been removed!' % item.name)
         return redirect(url_for('catalogDisplay'))
     else:
@@ -194,16 +969,26 @@ def editItem(item_id):
         alert += "</script><body onload='myFunction()'>"
         return alert
     if request.method == 'POST':
-        if request.form['item-name']:
-            item.name = request.form['item-name']
-        if request.form['item-description']:
-            item.description = request.form['item-description']
+        name = request.form['item-name']
+        description = request.form['item-description']
+        category_id = item.category_id
         if request.form['categories-list']:
-            item.category_id = request.form['categories-list']
-        category_name = session.query(Category).filter_by(
-                                        id=item.category_id).one().name
-        session.add(item)
-        session.commit()
+            category_id = formCategoryId(request.form['categories-list'])
+        category_name = categoryCache.get(session).names[category_id]
+
+        def edit(write_session):
+            item = write_session.query(Item).filter_by(id=item_id).one()
+            old_category_id = item.category_id
+            if name:
+                item.name = name
+            if description:
+                item.description = description
+            item.category_id = category_id
+            adjustItemCounts(write_session, [('edit', item, old_category_id)])
+            changeLog.record(write_session, [('edit', item, old_category_id)])
+            return item, old_category_id
+        item, old_category_id = runWrite(edit)
+        itemChanged('edit', item, old_category_id)
         flash('Item has been edited!')
         return redirect(url_for(
                                 'displaySpecificItem',
@@ -211,7 +996,7 @@ def editItem(item_id):
                                 item_name=item.name,
                                 item_id=item_id))
     else:
-        categories = session.query(Category).order_by(Category.name).all()
+        categories = categoryCache.get(session).categories
         return render_template('edit-item-form.html',
                                item=item,
                                categories=categories)
@@ -235,16 +1020,17 @@ def showLogin():
 # Logs in via Google Accounts
 # Taken from project.py in Full-Stack Foundations Udacity Course
 @app.route('/gconnect', methods=['POST'])
+@admission.limit('login', concurrency=2, queue=4, wait=5.0)
 def gconnect():
     if request.args.get('state') != login_session['state']:
         response = make_response(json.dumps('Invalid state parameter.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
     code = request.data
+    # Imported here so that only logins pay for loading oauth2client
+    from oauth2client.client import FlowExchangeError
     try:
-        oauth_flow = flow_from_clientsecrets('client_secrets.json', scope='')
-        oauth_flow.redirect_uri = 'postmessage'
-        credentials = oauth_flow.step2_exchange(code)
+        credentials = googleAuth.exchange(code)
     except FlowExchangeError:
         response = make_response(
             json.dumps('Failed to upgrade the authorization code.'), 401)
@@ -252,11 +1038,7 @@ def gconnect():
         return response
 
     # Check that the access token is valid.
-    access_token = credentials.access_token
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-           % access_token)
-    h = httplib2.Http()
-    result = json.loads(h.request(url, 'GET')[1])
+    result = googleAuth.tokenInfo(credentials)
     # If there was an error in the access token info, abort.
     if result.get('error') is not None:
         response = make_response(json.dumps(result.get('error')), 500)
@@ -272,7 +1054,7 @@ def gconnect():
         return response
 
     # Verify that the access token is valid for this app.
-    if result['issued_to'] != CLIENT_ID:
+    if result['issued_to'] != googleAuth.client_id:
         response = make_response(
             json.dumps("Token's client ID does not match app's."), 401)
         print "Token's client ID does not match app's."
@@ -293,11 +1075,7 @@ def gconnect():
     login_session['gplus_id'] = gplus_id
 
     # Get user info
-    userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-    params = {'access_token': credentials.access_token, 'alt': 'json'}
-    answer = requests.get(userinfo_url, params=params)
-
-    data = answer.json()
+    data = googleAuth.userInfo(credentials.access_token)
     login_session['provider'] = 'google'
     login_session['username'] = data['name']
     login_session['picture'] = data['picture']
@@ -346,6 +1124,7 @@ def disconnect():
 
 # Log out a user via Google
 @app.route('/gdisconnect')
+@admission.limit('login', concurrency=2, queue=4, wait=5.0)
 def gdisconnect():
     # Only disconnect a connected user.
     access_token = login_session.get('access_token')
@@ -354,10 +1133,7 @@ def gdisconnect():
             json.dumps('Current user not connected.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
-    url = 'https://accounts.google.com/o/oauth2/revoke?token=%s' % access_token
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[0]
-    if result['status'] == '200':
+    if googleAuth.revoke(access_token):
         response = make_response(json.dumps('Successfully disconnected.'), 200)
         response.headers['Content-Type'] = 'application/json'
         return response
@@ -372,28 +1148,49 @@ def gdisconnect():
 # Displays the items in a category
 @app.route('/catalog/<category_name>/')
 @app.route('/catalog/<category_name>/Items/')
+@versions.conditional(categoryScope, personal=True)
+@pageCache.cached(firstPageKey(categoryKey), categoryScope)
 def displayCategoryItems(category_name):
-    """ Display all the items in a category
+    """ Display one page of the items in a category
 
     Args:
         category_name: the name of the category
 
     Returns:
-        A category page that contains all the items
-        associated with that category
+        A category page that contains a page of the items
+        associated with that category, with links to the next
+        and previous pages
     """
-    categories = session.query(Category).order_by(Category.name).all()
-    category = session.query(Category).filter_by(name=category_name).one()
-    items = session.query(Item).filter_by(category_id=category.id).all()
+    model = readModel.current() if readModel.enabled else None
+    index = model.categories if model else categoryCache.get(session)
+    if category_name not in index.ids:
+        abort(404)
+    try:
+        after, before = pageCursor(request.args)
+    except ValueError:
+        abort(400)
+    category_id = index.ids[category_name]
+    if model is not None:
+        page = model.categoryPage(category_id, app.config['PAGE_SIZE'],
+                                  after, before)
+        total = model.itemCount(category_id)
+    else:
+        page = keysetPage(session.query(Item.id, Item.name)
+                          .filter(Item.category_id == category_id),
+                          Item.id, app.config['PAGE_SIZE'], after, before)
+        total = itemCount(session, category_id)
     return render_template(
         'category.html',
         category_name=category_name,
-        items=items,
-        categories=categories)
+        items=page.items,
+        page=page,
+        total=total,
+        categories=index.categories)
 
 
 # Displays the name and description of an item
 @app.route('/catalog/<category_name>/<item_name>/<item_id>')
+@pageCache.cached(itemKey, itemScope)
 def displaySpecificItem(category_name, item_name, item_id):
     """ Display info and operations associated with the item
 
@@ -409,7 +1206,14 @@ def displaySpecificItem(category_name, item_name, item_id):
         the options to edit and delete the item with be available
     """
     ownsItem = False
-    item = session.query(Item).filter_by(id=item_id).one()
+    if readModel.enabled:
+        item = readModel.current().item(item_id)
+    elif item_id.isdigit():
+        item = session.query(Item).filter_by(id=int(item_id)).first()
+    else:
+        item = None
+    if item is None:
+        abort(404)
     if 'username' in login_session and item.user_id == login_session['user_id']:
         ownsItem = True
     return render_template(
@@ -421,6 +1225,6 @@ def displaySpecificItem(category_name, item_name, item_id):
 
 
 if __name__ == '__main__':
-    app.secret_key = 'super_secret_key'
-    app.debug = True
-    app.run(host="0.0.0.0", port=8000)
+    create_app({'SECRET_KEY': os.environ.get('SECRET_KEY', 'super_secret_key'),
+                'DEBUG': True})
+    app.run(host="0.0.0.0", port=int(os.environ.get('PORT', 8000)))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+import hashlib
+import mimetypes
+import os
+from flask import Response, request, send_from_directory
+from compression import COMPRESSIBLE, compress, encodings, negotiate
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class Asset(object):
+    """ One file under static/ with its fingerprint and compressed copies """
+    __slots__ = ('name', 'fingerprinted', 'mtime', 'mimetype', 'digest',
+                 'data', 'encoded')
+
+    def __init__(self, folder, name, min_size):
+        path = os.path.join(folder, name)
+        self.name = name
+        self.mtime = os.path.getmtime(path)
+        self.mimetype = mimetypes.guess_type(name)[0] or \
+            'application/octet-stream'
+        with open(path, 'rb') as asset_file:
+            data = asset_file.read()
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        base, extension = os.path.splitext(name)
+        self.fingerprinted = '%s.%s%s' % (base, self.digest, extension)
+        self.data = None
+        self.encoded = {}
+        if self.mimetype in COMPRESSIBLE:
+            self.data = data
+            if len(data) >= min_size:
+                for encoding in encodings():
+                    body = compress(data, encoding,
+                                    11 if encoding == 'br' else 9)
+                    if len(body) < len(data):
+                        self.encoded[encoding] = body
+
+
+class StaticAssets(object):
+    """ Serves the files under static/ with content-hash fingerprints
+
+    url_for('static', filename='styles.css') links to a name that carries
+    a hash of the file, such as styles.3f2a1b9c0d4e.css, which is served
+    with a year-long immutable Cache-Control: a new version of a file gets
+    a new URL. Text files are compressed once with the best gzip and
+    brotli settings when the application starts, and each request is sent
+    the smallest copy its Accept-Encoding allows. Plain names keep working
+    with revalidation. In debug mode edited files are picked up.
+    """
+
+    def __init__(self, min_size=500):
+        self.min_size = min_size
+        self.folder = None
+        self.debug = False
+        self.assets = {}
+        self.fingerprinted = {}
+
+    def init_app(self, app):
+        """ Loads the static files and takes over the static endpoint
+
+        Args:
+            app: the Flask application
+        """
+        self.folder = app.static_folder
+        self.debug = app.debug
+        self.load()
+        app.url_defaults(self.addFingerprint)
+        app.view_functions['static'] = self.serve
+
+    def load(self):
+        """ Fingerprints and precompresses every file under static/ """
+        assets = {}
+        for directory, names, files in os.walk(self.folder):
+            for filename in files:
+                name = os.path.relpath(os.path.join(directory, filename),
+                                       self.folder).replace(os.sep, '/')
+                assets[name] = Asset(self.folder, name, self.min_size)
+        self.assets = assets
+        self.fingerprinted = dict((asset.fingerprinted, asset)
+                                  for asset in assets.values())
+
+    def lookup(self, name):
+        asset = self.assets.get(name)
+        if self.debug and asset is not None:
+            path = os.path.join(self.folder, name)
+            if not os.path.exists(path) or \
+                    os.path.getmtime(path) != asset.mtime:
+                self.load()
+                asset = self.assets.get(name)
+        return asset
+
+    def addFingerprint(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            asset = self.lookup(values['filename'])
+            if asset is not None:
+                values['filename'] = asset.fingerprinted
+
+    def serve(self, filename):
+        """ Sends a static file, fingerprinted or not
+
+        Args:
+            filename: the path of the file under static/
+
+        Returns:
+            The file, compressed if the client accepts it
+        """
+        asset = self.fingerprinted.get(filename)
+        immutable = asset is not None
+        if asset is None:
+            asset = self.lookup(filename)
+        if asset is None or asset.data is None:
+            response = send_from_directory(
+                self.folder, asset.name if asset else filename)
+        else:
+            encoding = negotiate([encoding for encoding in encodings()
+                                  if encoding in asset.encoded])
+            response = Response(asset.encoded.get(encoding, asset.data),
+                                mimetype=asset.mimetype)
+            if encoding is not None:
+                response.headers['Content-Encoding'] = encoding
+            if asset.encoded:
+                response.vary.add('Accept-Encoding')
+            response.set_etag(asset.digest + ('-' + encoding
+                                              if encoding else ''))
+            response.make_conditional(request)
+        if immutable:
+            response.headers['Cache-Control'] = IMMUTABLE
+        else:
+            response.cache_control.no_cache = True
+        return response
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+import hashlib
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from database_setup import BatchRequest, CatalogChangeLock, Item
+
+NAME_LENGTH = Item.__table__.c.name.type.length
+DESCRIPTION_LENGTH = Item.__table__.c.description.type.length
+KEY_LENGTH = BatchRequest.__table__.c.key.type.length
+
+
+class KeyReused(Exception):
+    """ An idempotency key was sent again with different operations """
+
+
+def fingerprint(operations):
+    """ Hashes a batch so a reused idempotency key can be recognised
+
+    Args:
+        operations: the decoded list of operations
+
+    Returns:
+        A hex digest that is the same for equal batches
+    """
+    encoded = json.dumps(operations, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def checkOperation(operation, category_ids):
+    """ Validates the shape of one operation without touching the database
+
+    Args:
+        operation: a dict with an 'op' of create, update or delete
+        category_ids: the ids of the existing categories
+
+    Returns:
+        An error message, or None if the operation is well formed
+    """
+    if not isinstance(operation, dict):
+        return 'operation must be an object'
+    op = operation.get('op')
+    if op not in ('create', 'update', 'delete'):
+        return 'op must be create, update or delete'
+    if op != 'create' and not isInteger(operation.get('item_id')):
+        return 'item_id must be an integer'
+    if op == 'delete':
+        return None
+    if op == 'create' and 'name' not in operation:
+        return 'name is required'
+    if op == 'create' and 'category_id' not in operation:
+        return 'category_id is required'
+    if op == 'update' and not any(field in operation for field in
+                                  ('name', 'description', 'category_id')):
+        return 'nothing to update'
+    if 'name' in operation and not (
+            isText(operation['name']) and
+            0 < len(operation['name']) <= NAME_LENGTH):
+        return 'name must be 1 to %d characters' % NAME_LENGTH
+    if 'description' in operation and not (
+            isText(operation['description']) and
+            len(operation['description']) <= DESCRIPTION_LENGTH):
+        return 'description must be at most %d characters' % \
+            DESCRIPTION_LENGTH
+    if 'category_id' in operation and (
+            not isInteger(operation['category_id']) or
+            operation['category_id'] not in category_ids):
+        return 'category_id is not an existing category'
+    return None
+
+
+def isInteger(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def isText(value):
+    return isinstance(value, basestring)
+
+
+def applyBatch(session, user_id, operations, category_ids):
+    """ Validates a batch of item writes and applies it in one transaction
+
+    Ownership of every updated or deleted item is checked with a single
+    query, and the writes are sent as bulk statements. The new items are
+    inserted with one executemany and their ids read back with one query,
+    under the catalog_change_lock row lock so that no other write commits
+    items in between. If any operation is invalid nothing is written. The
+    caller commits.
+
+    Args:
+        session: the database session to write with
+        user_id: the id of the logged in user
+        operations: a list of operation dicts
+        category_ids: the ids of the existing categories
+
+    Returns:
+        A (results, changes) tuple. results has one dict per operation.
+        changes lists the (action, item, old category id) of every write
+        and is empty when the batch was rejected.
+    """
+    errors = [checkOperation(operation, category_ids)
+              for operation in operations]
+    targets = {}
+    for index, operation in enumerate(operations):
+        if errors[index] is None and operation['op'] != 'create':
+            if operation['item_id'] in targets:
+                errors[index] = 'item_id appears more than once'
+            targets[operation['item_id']] = index
+    rows = {}
+    if targets:
+        rows = dict((row.id, row) for row in session.query(
+            Item.id, Item.name, Item.description, Item.category_id,
+            Item.user_id).filter(Item.id.in_(list(targets))))
+    for index, operation in enumerate(operations):
+        if errors[index] is None and operation['op'] != 'create':
+            row = rows.get(operation['item_id'])
+            if row is None:
+                errors[index] = 'no item with that id exists'
+            elif row.user_id != user_id:
+                errors[index] = 'you are not authorized to change this item'
+
+    if any(errors):
+        results = []
+        for index, (operation, error) in enumerate(zip(operations, errors)):
+            result = {'index': index,
+                      'op': operation.get('op')
+                      if isinstance(operation, dict) else None,
+                      'status': 'error' if error else 'not_applied'}
+            if error:
+                result['error'] = error
+            results.append(result)
+        return results, []
+
+    creates, updates, deletes = [], [], []
+    results, changes = [], []
+    for index, operation in enumerate(operations):
+        op = operation['op']
+        if op == 'create':
+            values = {'name': operation['name'],
+                      'description': operation.get('description'),
+                      'category_id': operation['category_id'],
+                      'user_id': user_id}
+            creates.append(values)
+            changes.append(('create', values, None))
+        elif op == 'update':
+            row = rows[operation['item_id']]
+            values = {'id': row.id, 'name': row.name,
+                      'description': row.description,
+                      'category_id': row.category_id, 'user_id': user_id}
+            changed = dict((field, operation[field]) for field in
+                           ('name', 'description', 'category_id')
+                           if field in operation)
+            values.update(changed)
+            updates.append(dict(changed, id=row.id))
+            changes.append(('edit', values, row.category_id))
+        else:
+            row = rows[operation['item_id']]
+            deletes.append(row.id)
+            changes.append(('delete', {'id': row.id, 'name': row.name,
+                                       'description': row.description,
+                                       'category_id': row.category_id,
+                                       'user_id': user_id}, None))
+        results.append({'index': index, 'op': op})
+
+    if creates:
+        session.query(CatalogChangeLock).with_for_update().first()
+        newest = session.query(func.max(Item.id)).scalar() or 0
+        session.execute(Item.__table__.insert(), creates)
+        ids = session.query(Item.id).filter(Item.id > newest) \
+            .order_by(Item.id).all()
+        for values, (item_id,) in zip(creates, ids):
+            values['id'] = item_id
+    if updates:
+        session.bulk_update_mappings(Item, updates)
+    if deletes:
+        session.query(Item).filter(Item.id.in_(deletes)) \
+            .delete(synchronize_session=False)
+
+    for result, (action, values, old_category_id) in zip(results, changes):
+        result['status'] = {'create': 'created', 'edit': 'updated',
+                            'delete': 'deleted'}[action]
+        result['item_id'] = values['id']
+    return results, [(action, Item(**values), old_category_id)
+                     for action, values, old_category_id in changes]
+
+
+def storedResponse(session, user_id, key, digest, ttl):
+    """ Looks up the response of a batch that was already applied
+
+    Args:
+        session: the database session
+        user_id: the id of the logged in user
+        key: the idempotency key sent with the batch
+        digest: the fingerprint of the batch
+        ttl: how long keys are remembered, in seconds
+
+    Returns:
+        The stored response body, or None if the key is new. Raises
+        KeyReused if the key was used for a different batch.
+    """
+    record = session.query(BatchRequest).filter(
+        BatchRequest.user_id == user_id, BatchRequest.key == key,
+        BatchRequest.created >= datetime.utcnow() - timedelta(seconds=ttl)) \
+        .first()
+    if record is None:
+        return None
+    if record.fingerprint != digest:
+        raise KeyReused(key)
+    return json.loads(record.response)
+
+
+def rememberResponse(session, user_id, key, digest, response, ttl):
+    """ Stores a batch's response in the batch's own transaction
+
+    Keys older than ttl are forgotten at the same time. If another request
+    with the same key commits first, the commit fails on the unique key.
+
+    Args:
+        session: the database session the batch was applied in
+        user_id: the id of the logged in user
+        key: the idempotency key sent with the batch
+        digest: the fingerprint of the batch
+        response: the response body to replay
+        ttl: how long keys are remembered, in seconds
+    """
+    now = datetime.utcnow()
+    session.query(BatchRequest).filter(
+        BatchRequest.created < now - timedelta(seconds=ttl)) \
+        .delete(synchronize_session=False)
+    session.add(BatchRequest(user_id=user_id, key=key, fingerprint=digest,
+                             response=json.dumps(response), created=now))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# Hammers the create, edit and delete routes from many threads at once.
+#
+# Usage, from the repository root:
+#   python benchmarks/concurrent_writes.py [threads] [rounds]
+#
+# Runs against a throwaway SQLite file unless DATABASE_URL is set, in which
+# case that database must already have the schema and will get test rows.
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.environ.get('DATABASE_URL'):
+    DB_FILE = os.path.join(tempfile.mkdtemp(), 'concurrent.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+from database_setup import Category, Item, User  # noqa: E402
+from application import create_app, session  # noqa: E402
+
+app = create_app({'SECRET_KEY': 'concurrency-test'})  # creates the schema
+
+
+def setUp(threads):
+    """ Creates one category and one user per thread
+
+    Returns:
+        A (category id, list of user ids) tuple
+    """
+    category = Category(name='Concurrency %d' % time.time())
+    session.add(category)
+    users = [User(name='writer %d' % n,
+                  email='writer%d-%d@example.com' % (n, time.time()))
+             for n in range(threads)]
+    session.add_all(users)
+    session.commit()
+    ids = category.id, [user.id for user in users]
+    session.remove()
+    return ids
+
+
+def writer(user_id, category_id, rounds, errors):
+    """ Creates, edits and deletes items as one logged in user """
+    client = app.test_client()
+    with client.session_transaction() as login_session:
+        login_session['username'] = 'writer'
+        login_session['email'] = 'writer@example.com'
+        login_session['user_id'] = user_id
+    for n in range(rounds):
+        name = 'item-%d-%d' % (user_id, n)
+        response = client.post('/catalog/new-item', data={
+            'item-name': name,
+            'item-description': 'created',
+            'categories-list': category_id})
+        if response.status_code != 302:
+            errors.append(('create', response.status_code))
+            continue
+        item_id = session.query(Item.id).filter_by(
+            name=name, user_id=user_id).scalar()
+        session.remove()
+        response = client.post('/catalog/edit/%d' % item_id, data={
+            'item-name': name + '-edited',
+            'item-description': 'edited',
+            'categories-list': category_id})
+        if response.status_code != 302:
+            errors.append(('edit', response.status_code))
+        if n % 2:
+            response = client.post('/catalog/delete/%d' % item_id)
+            if response.status_code != 302:
+                errors.append(('delete', response.status_code))
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    category_id, user_ids = setUp(threads)
+    errors = []
+    workers = [threading.Thread(target=writer,
+                                args=(user_id, category_id, rounds, errors))
+               for user_id in user_ids]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    remaining = session.query(Item).filter_by(category_id=category_id).all()
+    expected = threads * (rounds - rounds // 2)
+    edited = all(item.name.endswith('-edited') for item in remaining)
+    print '%d threads x %d rounds in %.2fs (%.1f writes/s)' % (
+        threads, rounds, elapsed, threads * rounds * 2.5 / elapsed)
+    print 'errors: %d, items left: %d (expected %d), all edited: %s' % (
+        len(errors), len(remaining), expected, edited)
+    if errors or len(remaining) != expected or not edited:
+        sys.exit(1)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Builds a synthetic catalog of a configurable size.
+#
+# Usage, from the repository root:
+#   python benchmarks/datagen.py [--categories N] [--items N] [--users N]
+#                                [--seed N] [--database URL]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402
+from change_log import newEpoch  # noqa: E402
+from database_setup import Base, Category, Item, User  # noqa: E402
+from db import databaseURL  # noqa: E402
+from item_counts import recountItems  # noqa: E402
+
+WORDS = ('red blue green black white small large light heavy classic pro '
+         'junior adult indoor outdoor leather mesh carbon wooden steel ball '
+         'glove shoe board stick net bag helmet pad shirt shorts cap bat '
+         'disc rope harness skate table racket goal').split()
+
+
+def newestIds(engine, table, count):
+    """ Gets the ids of the rows just inserted into a table, oldest first """
+    rows = engine.execute('SELECT id FROM %s ORDER BY id DESC LIMIT %d'
+                          % (table, count))
+    return sorted(row[0] for row in rows)
+
+
+def generateCatalog(engine, categories=20, items=10000, users=10, seed=1,
+                    batch_size=10000):
+    """ Fills an empty database with random users, categories and items
+
+    Rows are inserted with the tables of the database_setup models, so the
+    data goes through the same schema, indexes and triggers as real data.
+    Category n is named 'Category n', user n has the email
+    user<n>@example.com and items are spread evenly over the categories
+    and users.
+
+    Args:
+        engine: the engine connected to the database
+        categories: the number of categories to create
+        items: the number of items to create
+        users: the number of users to create
+        seed: the seed of the random descriptions
+        batch_size: the number of items inserted per statement
+
+    Returns:
+        A dict with the number of rows of each kind
+    """
+    generator = random.Random(seed)
+    Base.metadata.create_all(engine)
+    engine.execute(User.__table__.insert(), [
+        {'name': 'User %d' % n, 'email': 'user%d@example.com' % n,
+         'picture': None} for n in range(1, users + 1)])
+    engine.execute(Category.__table__.insert(), [
+        {'name': 'Category %d' % n} for n in range(1, categories + 1)])
+    user_ids = newestIds(engine, '"user"', users)
+    category_ids = newestIds(engine, 'category', categories)
+    batch = []
+    for n in range(items):
+        batch.append({
+            'name': 'Item %d' % (n + 1),
+            'description': ' '.join(generator.sample(WORDS, 8)),
+            'category_id': category_ids[n % categories],
+            'user_id': user_ids[n % users]})
+        if len(batch) == batch_size:
+            engine.execute(Item.__table__.insert(), batch)
+            batch = []
+    if batch:
+        engine.execute(Item.__table__.insert(), batch)
+    recountItems(engine)
+    newEpoch(engine)
+    return {'categories': categories, 'items': items, 'users': users}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a synthetic catalog')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database', default=None,
+                        help='database URL (default: %s)' % databaseURL())
+    args = parser.parse_args()
+    started = time.time()
+    counts = generateCatalog(create_engine(args.database or databaseURL()),
+                             args.categories, args.items, args.users,
+                             args.seed)
+    print 'created %(categories)d categories, %(items)d items and ' \
+          '%(users)d users' % counts + ' in %.1fs' % (time.time() - started)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# Measures write throughput and latency with and without group commit.
+#
+# Usage, from the repository root:
+#   python benchmarks/group_commit.py [--items N] [--writers N]
+#       [--duration SECONDS] [--window SECONDS] [--synchronous MODE]
+#       [--write-queue on|off]
+#
+# A synthetic catalog is generated into a throwaway SQLite database. Writer
+# threads, each logged in as its own user, keep creating items through the
+# new item form, editing them and deleting every other one, for --duration
+# seconds. Without --write-queue the benchmark runs once with every request
+# committing its own transaction and once with WRITE_QUEUE=1, each in a
+# fresh process, and prints both. Group commit pays off the most when each
+# commit syncs to disk, so try --synchronous FULL as well.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from mixed_readwrite import summary  # noqa: E402
+
+
+def run(args):
+    """ Runs the benchmark in this process, with or without the write queue
+
+    Returns:
+        A dict of the write latencies, throughput and group sizes
+    """
+    os.environ['WRITE_QUEUE'] = '1' if args.write_queue == 'on' else '0'
+    os.environ['WRITE_QUEUE_WINDOW'] = str(args.window)
+    os.environ['SQLITE_SYNCHRONOUS'] = args.synchronous
+    os.environ['PAGE_CACHE_BACKEND'] = 'none'
+    os.environ.setdefault('SLOW_QUERY_SECONDS', '60')
+    database = os.path.join(tempfile.mkdtemp(), 'group.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database
+    os.chdir(ROOT)
+    from sqlalchemy import create_engine
+    from datagen import generateCatalog
+    sizes = generateCatalog(create_engine(os.environ['DATABASE_URL']),
+                            args.categories, args.items, args.writers)
+    import application
+    app = application.create_app({'SECRET_KEY': 'group-commit'})
+    lock = threading.Lock()
+    writes = {'create': [], 'edit': [], 'delete': []}
+    errors = []
+
+    def timed(action, client, url, data=None):
+        start = time.time()
+        response = client.post(url, data=data)
+        with lock:
+            writes[action].append(time.time() - start)
+            if response.status_code != 302:
+                errors.append((action, response.status_code))
+        return response.status_code == 302
+
+    def writer(user_id):
+        client = app.test_client()
+        with client.session_transaction() as login_session:
+            login_session['username'] = 'User %d' % user_id
+            login_session['email'] = 'user%d@example.com' % user_id
+            login_session['user_id'] = user_id
+        category_id = user_id % sizes['categories'] + 1
+        n = 0
+        while time.time() < deadline:
+            name = 'Group item %d-%d' % (user_id, n)
+            if not timed('create', client, '/catalog/new-item', {
+                    'item-name': name,
+                    'item-description': 'created',
+                    'categories-list': category_id}):
+                continue
+            item_id = application.session.query(application.Item.id) \
+                .filter_by(name=name, user_id=user_id).scalar()
+            application.session.remove()
+            timed('edit', client, '/catalog/edit/%d' % item_id, {
+                'item-name': name,
+                'item-description': 'edited',
+                'categories-list': category_id})
+            if n % 2:
+                timed('delete', client, '/catalog/delete/%d' % item_id)
+            n += 1
+
+    threads = [threading.Thread(target=writer, args=(n + 1,))
+               for n in range(args.writers)]
+    started = time.time()
+    deadline = started + args.duration
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    total = sum(len(samples) for samples in writes.values())
+    result = dict((action, summary(samples))
+                  for action, samples in writes.items())
+    result.update({'write_queue': args.write_queue,
+                   'synchronous': args.synchronous,
+                   'writes': summary(sum(writes.values(), [])),
+                   'writes_per_second': total / elapsed,
+                   'errors': len(errors)})
+    if args.write_queue == 'on':
+        stats = application.writeQueue.stats()
+        result['groups'] = stats['batches']
+        result['largest_group'] = stats['largest_batch']
+    return result
+
+
+def report(result):
+    print 'write queue %s, synchronous %s: %.1f writes/s, %d errors' % (
+        result['write_queue'], result['synchronous'],
+        result['writes_per_second'], result['errors'])
+    if 'groups' in result:
+        print '  %d transactions, %.1f writes each on average, at most %d' % (
+            result['groups'], result['writes']['requests'] /
+            float(max(result['groups'], 1)), result['largest_group'])
+    print '  %-8s %7s %8s %8s %8s %8s' % ('', 'reqs', 'p50 ms', 'p95 ms',
+                                          'p99 ms', 'max ms')
+    for name in ('create', 'edit', 'delete', 'writes'):
+        row = result[name]
+        print '  %-8s %7d %8.2f %8.2f %8.2f %8.2f' % (
+            name, row['requests'], row['p50_ms'], row['p95_ms'],
+            row['p99_ms'], row['max_ms'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Write throughput with and without group commit')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--window', type=float, default=0.002,
+                        help='WRITE_QUEUE_WINDOW in seconds')
+    parser.add_argument('--synchronous', default='NORMAL',
+                        help='the SQLite synchronous pragma')
+    parser.add_argument('--write-queue', choices=['on', 'off'],
+                        help='run once with the write queue on or off')
+    parser.add_argument('--json', action='store_true',
+                        help='print the result as JSON')
+    args = parser.parse_args()
+
+    if args.write_queue:
+        result = run(args)
+        if args.json:
+            print json.dumps(result)
+        else:
+            report(result)
+        sys.exit(0)
+    for mode in ('off', 'on'):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--json',
+             '--write-queue', mode] +
+            ['--%s=%s' % (name, getattr(args, name)) for name in
+             ('categories', 'items', 'writers', 'duration', 'window',
+              'synchronous')])
+        report(json.loads(output.splitlines()[-1]))
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# Drives every route of the application and reports how it performs.
+#
+# Usage, from the repository root:
+#   python benchmarks/loadtest.py [--categories N] [--items N] [--users N]
+#       [--requests N] [--concurrency N] [--routes a,b] [--output FILE]
+#       [--compare FILE] [--tolerance FRACTION] [--page-cache]
+#       [--admission-control]
+#
+# A synthetic catalog is generated into a throwaway SQLite database (or
+# the empty database in DATABASE_URL) and each route is exercised through
+# the Flask test client, from --concurrency threads at once. Logged in
+# routes use a stubbed login session. For every route the throughput,
+# p50/p95/p99 latency and SQL queries per request are reported along with
+# the peak RSS of the process. The anonymous page cache is turned off so
+# pages are really rendered, unless --page-cache is given. Admission
+# control is turned off so every request is served, unless
+# --admission-control is given. --output saves the results as JSON and
+# --compare flags routes that got slower than a saved run.
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class QueryCounter(object):
+    """ Counts the SQL statements each thread sends to an engine """
+
+    def __init__(self, *engines):
+        from sqlalchemy import event
+        self.local = threading.local()
+        for engine in set(engines):
+            event.listen(engine, 'before_cursor_execute', self.executed)
+
+    def executed(self, *args):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def reset(self):
+        self.local.count = 0
+
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+
+class Driver(object):
+    """ Sends the requests of each route and records their cost """
+
+    def __init__(self, app, counter, sizes):
+        self.app = app
+        self.counter = counter
+        self.sizes = sizes
+        self.lock = threading.Lock()
+        self.own_items = {}
+
+    def client(self, user=None):
+        client = self.app.test_client()
+        if user is not None:
+            with client.session_transaction() as login_session:
+                login_session['username'] = 'User %d' % user
+                login_session['email'] = 'user%d@example.com' % user
+                login_session['user_id'] = user
+        return client
+
+    def get(self, client, url):
+        """ Sends a GET and reads the whole body, streamed or not """
+        return client.get(url, buffered=True).status_code
+
+    def randomItem(self, generator):
+        item_id = generator.randint(1, self.sizes['items'])
+        category = (item_id - 1) % self.sizes['categories'] + 1
+        return item_id, 'Category %d' % category
+
+    def request(self, route, client, generator, user):
+        """ Sends one request of a route
+
+        Returns:
+            The response status code
+        """
+        if route == 'front':
+            return self.get(client, '/catalog/')
+        if route == 'category':
+            category = generator.randint(1, self.sizes['categories'])
+            return self.get(client, '/catalog/Category %d/' % category)
+        if route == 'item':
+            item_id, category = self.randomItem(generator)
+            return self.get(client, '/catalog/%s/Item %d/%d'
+                            % (category, item_id, item_id))
+        if route == 'catalog_json':
+            return self.get(client, '/catalog.json')
+        if route == 'item_json':
+            item_id, category = self.randomItem(generator)
+            return self.get(client, '/item_%d.json' % item_id)
+        if route == 'search':
+            return self.get(client, '/search.json?q=%s' % generator.choice(
+                ['ball', 'glo', 'red shoe', 'car']))
+        if route == 'create':
+            response = client.post('/catalog/new-item', data={
+                'item-name': 'Load test item',
+                'item-description': 'created by the load test',
+                'categories-list': generator.randint(
+                    1, self.sizes['categories'])})
+            return response.status_code
+        try:
+            own = self.own_items[user]
+            item_id = own.pop() if route == 'delete' else generator.choice(own)
+        except (KeyError, IndexError):
+            return None
+        if route == 'edit':
+            response = client.post('/catalog/edit/%d' % item_id,
+                                   data={'item-name': 'Edited item',
+                                         'item-description': 'edited',
+                                         'categories-list': ''})
+            return response.status_code
+        if route == 'delete':
+            return client.post('/catalog/delete/%d' % item_id).status_code
+
+    def run(self, route, requests, concurrency):
+        """ Sends requests for one route from several threads
+
+        Returns:
+            A dict of the route's measurements
+        """
+        logged_in = route in ('create', 'edit', 'delete')
+        samples = []
+        queries = []
+        errors = []
+
+        def worker(number, count):
+            generator = random.Random(number)
+            user = (number % self.sizes['users']) + 1 if logged_in else None
+            client = self.client(user)
+            for n in range(count):
+                self.counter.reset()
+                start = time.time()
+                status = self.request(route, client, generator, user)
+                elapsed = time.time() - start
+                if status is None:
+                    continue
+                with self.lock:
+                    samples.append(elapsed)
+                    queries.append(self.counter.count())
+                    if status >= 400:
+                        errors.append(status)
+
+        counts = [requests // concurrency + (n < requests % concurrency)
+                  for n in range(concurrency)]
+        threads = [threading.Thread(target=worker, args=(n, count))
+                   for n, count in enumerate(counts)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.time() - start
+        samples.sort()
+        return {
+            'requests': len(samples),
+            'errors': len(errors),
+            'throughput': len(samples) / wall if wall else 0,
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'queries_per_request': (float(sum(queries)) / len(queries)
+                                    if queries else 0),
+        }
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def peakRSS():
+    """ Gets the peak resident set size of this process in megabytes """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return usage / (1024.0 * 1024)
+    return usage / 1024.0
+
+
+def ownItems(engine, users):
+    """ Maps each user to the ids of the items they own """
+    owned = {}
+    for item_id, user_id in engine.execute('SELECT id, user_id FROM item'):
+        if user_id <= users:
+            owned.setdefault(user_id, []).append(item_id)
+    return owned
+
+
+def compare(results, baseline, tolerance):
+    """ Prints how each route changed against a saved run
+
+    Returns:
+        The names of the routes whose p95 latency or query count grew by
+        more than the tolerance
+    """
+    regressions = []
+    for route, current in sorted(results['routes'].items()):
+        previous = baseline['routes'].get(route)
+        if previous is None:
+            continue
+        latency = current['p95_ms'] / max(previous['p95_ms'], 1e-6) - 1
+        queries = (current['queries_per_request'] -
+                   previous['queries_per_request'])
+        slower = latency > tolerance or queries > 0.5
+        print '%-13s p95 %+6.1f%%  queries %+5.1f%s' % (
+            route, latency * 100, queries, '  REGRESSION' if slower else '')
+        if slower:
+            regressions.append(route)
+    return regressions
+
+
+ROUTES = ['front', 'category', 'item', 'catalog_json', 'item_json', 'search',
+          'create', 'edit', 'delete']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test every route')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--output', help='save the results to a JSON file')
+    parser.add_argument('--compare', help='a saved JSON run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95 slowdown, as a fraction')
+    parser.add_argument('--page-cache', action='store_true',
+                        help='keep the anonymous page cache enabled')
+    parser.add_argument('--admission-control', action='store_true',
+                        help='keep the per-route concurrency limits enabled')
+    args = parser.parse_args()
+
+    if not args.page_cache:
+        os.environ['PAGE_CACHE_BACKEND'] = 'none'
+    if not args.admission_control:
+        os.environ['ADMISSION_CONTROL'] = '0'
+
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'loadtest.db')
+    os.chdir(ROOT)
+    from sqlalchemy import create_engine
+    from datagen import generateCatalog
+    sizes = generateCatalog(create_engine(os.environ['DATABASE_URL']),
+                            args.categories, args.items, args.users)
+    import application
+    app = application.create_app({'SECRET_KEY': 'load-test'})
+    engine = application.engine
+    driver = Driver(app, QueryCounter(engine, application.readEngine), sizes)
+    driver.own_items = ownItems(engine, args.users)
+
+    results = {'sizes': sizes,
+               'concurrency': args.concurrency,
+               'python': platform.python_version(),
+               'database': engine.dialect.name,
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'routes': {}}
+    print '%-13s %8s %8s %8s %8s %8s %7s %6s' % (
+        'route', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'errors',
+        'reqs')
+    for route in args.routes.split(','):
+        requests = args.requests
+        if route == 'catalog_json':
+            requests = max(args.requests // 20, args.concurrency)
+        result = driver.run(route, requests, args.concurrency)
+        results['routes'][route] = result
+        print '%-13s %8.1f %8.2f %8.2f %8.2f %8.1f %7d %6d' % (
+            route, result['throughput'], result['p50_ms'], result['p95_ms'],
+            result['p99_ms'], result['queries_per_request'],
+            result['errors'], result['requests'])
+    results['peak_rss_mb'] = peakRSS()
+    print 'peak RSS: %.1f MB' % results['peak_rss_mb']
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as saved:
+            if compare(results, json.load(saved), args.tolerance):
+                sys.exit(1)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# Measures how reader latency holds up while writes come in bursts.
+#
+# Usage, from the repository root:
+#   python benchmarks/mixed_readwrite.py [--items N] [--readers N]
+#       [--writers N] [--duration SECONDS] [--burst SECONDS]
+#       [--pause SECONDS] [--journal-mode MODE]
+#
+# A synthetic catalog is generated into a throwaway SQLite database. Reader
+# threads keep loading category and item pages while writer threads add
+# items through the new item form during --burst seconds out of every
+# --burst + --pause. Reader latency is reported separately for requests
+# that started during a burst and between bursts. Without --journal-mode
+# the benchmark runs once with the old rollback journal (DELETE) and once
+# with WAL, each in a fresh process, and prints both.
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {'requests': len(samples),
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'max_ms': (samples[-1] if samples else 0) * 1000}
+
+
+def run(args):
+    """ Runs the benchmark in this process with one journal mode
+
+    Returns:
+        A dict of the reader latencies and write counts
+    """
+    os.environ['SQLITE_JOURNAL_MODE'] = args.journal_mode
+    os.environ['PAGE_CACHE_BACKEND'] = 'none'
+    os.environ.setdefault('SLOW_QUERY_SECONDS', '60')
+    database = os.path.join(tempfile.mkdtemp(), 'mixed.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database
+    os.chdir(ROOT)
+    from sqlalchemy import create_engine
+    from datagen import generateCatalog
+    sizes = generateCatalog(create_engine(os.environ['DATABASE_URL']),
+                            args.categories, args.items, args.writers)
+    import application
+    app = application.create_app({'SECRET_KEY': 'mixed-load'})
+    period = args.burst + args.pause
+    started = time.time()
+    deadline = started + args.duration
+    lock = threading.Lock()
+    reads = {'burst': [], 'idle': []}
+    writes = []
+    errors = []
+
+    def bursting(now):
+        return (now - started) % period < args.burst
+
+    def reader(number):
+        generator = random.Random(number)
+        client = app.test_client()
+        while time.time() < deadline:
+            if generator.random() < 0.5:
+                url = '/catalog/Category %d/' % generator.randint(
+                    1, sizes['categories'])
+            else:
+                item_id = generator.randint(1, sizes['items'])
+                url = '/catalog/Category %d/Item %d/%d' % (
+                    (item_id - 1) % sizes['categories'] + 1, item_id, item_id)
+            start = time.time()
+            status = client.get(url, buffered=True).status_code
+            elapsed = time.time() - start
+            with lock:
+                reads['burst' if bursting(start) else 'idle'].append(elapsed)
+                if status >= 400:
+                    errors.append(status)
+
+    def writer(user_id):
+        generator = random.Random(-user_id)
+        client = app.test_client()
+        with client.session_transaction() as login_session:
+            login_session['username'] = 'User %d' % user_id
+            login_session['email'] = 'user%d@example.com' % user_id
+            login_session['user_id'] = user_id
+        while time.time() < deadline:
+            now = time.time()
+            if not bursting(now):
+                time.sleep(period - (now - started) % period)
+                continue
+            start = time.time()
+            status = client.post('/catalog/new-item', data={
+                'item-name': 'Burst item',
+                'item-description': 'written during a burst',
+                'categories-list': generator.randint(
+                    1, sizes['categories'])}).status_code
+            with lock:
+                writes.append(time.time() - start)
+                if status >= 400:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=reader, args=(n,))
+               for n in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(n + 1,))
+                for n in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {'journal_mode': args.journal_mode,
+            'engines': 2 if application.readEngine is not
+            application.engine else 1,
+            'reads_during_bursts': summary(reads['burst']),
+            'reads_between_bursts': summary(reads['idle']),
+            'writes': summary(writes),
+            'errors': len(errors)}
+
+
+def report(result):
+    print 'journal mode %s, %d engine(s), %d errors' % (
+        result['journal_mode'], result['engines'], result['errors'])
+    print '  %-22s %7s %8s %8s %8s %8s' % ('', 'reqs', 'p50 ms', 'p95 ms',
+                                           'p99 ms', 'max ms')
+    for name in ('reads_between_bursts', 'reads_during_bursts', 'writes'):
+        row = result[name]
+        print '  %-22s %7d %8.2f %8.2f %8.2f %8.2f' % (
+            name.replace('_', ' '), row['requests'], row['p50_ms'],
+            row['p95_ms'], row['p99_ms'], row['max_ms'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Reader latency during write bursts')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--burst', type=float, default=0.5)
+    parser.add_argument('--pause', type=float, default=0.5)
+    parser.add_argument('--journal-mode',
+                        help='run once with this SQLite journal mode')
+    parser.add_argument('--json', action='store_true',
+                        help='print the result as JSON')
+    args = parser.parse_args()
+
+    if args.journal_mode:
+        result = run(args)
+        if args.json:
+            print json.dumps(result)
+        else:
+            report(result)
+        sys.exit(0)
+    for mode in ('DELETE', 'WAL'):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--json',
+             '--journal-mode', mode] +
+            ['--%s=%s' % (name, getattr(args, name)) for name in
+             ('categories', 'items', 'readers', 'writers', 'duration',
+              'burst', 'pause')])
+        report(json.loads(output.splitlines()[-1]))
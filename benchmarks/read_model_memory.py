@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Reports how much memory the in-memory read model takes.
+#
+# Usage, from the repository root:
+#   python benchmarks/read_model_memory.py [--categories N]
+#       [--items N [N ...]] [--json]
+#
+# For each catalog size a synthetic catalog is generated into a throwaway
+# SQLite database and the read model is loaded from it in a fresh process.
+# The process reports the growth of its resident set while loading, an
+# estimate from sys.getsizeof of the records, strings, indexes and dicts,
+# and the load time. Both sizes are also given per 100,000 items.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+def residentBytes():
+    """ Reads the resident set size of this process, on Linux """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def modelBytes(model):
+    """ Adds up sys.getsizeof over everything the model holds """
+    total = sys.getsizeof(model.items) + sys.getsizeof(model.by_category) + \
+        sys.getsizeof(model.ordered)
+    for ids in model.by_category.values():
+        total += sys.getsizeof(ids)
+    for record in model.items.values():
+        total += sys.getsizeof(record) + sys.getsizeof(record.id)
+        for value in (record.name, record.description):
+            if value is not None:
+                total += sys.getsizeof(value)
+    return total
+
+
+def measure(categories, items):
+    """ Generates a catalog and loads the read model from it
+
+    Returns:
+        A dict of the sizes in bytes and the load time in seconds
+    """
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'model.db')
+    from sqlalchemy import create_engine
+    from datagen import generateCatalog
+    sizes = generateCatalog(create_engine(os.environ['DATABASE_URL']),
+                            categories, items, 10)
+    from db import DBSession, createEngines, session
+    from database_setup import Base
+    from read_model import ReadModel
+    writer, reader = createEngines(os.environ['DATABASE_URL'])
+    DBSession.configure(writer=writer, reader=reader)
+    Base.metadata.create_all(writer)
+    before = residentBytes()
+    started = time.time()
+    model = ReadModel().load(session)
+    seconds = time.time() - started
+    session.remove()
+    resident = residentBytes() - before
+    estimate = modelBytes(model)
+    return {'items': sizes['items'],
+            'load_seconds': seconds,
+            'resident_bytes': resident,
+            'estimated_bytes': estimate,
+            'resident_per_100k': resident * 100000.0 / max(sizes['items'], 1),
+            'estimated_per_100k': estimate * 100000.0 /
+            max(sizes['items'], 1)}
+
+
+def report(result):
+    print '%9d items  load %6.2fs  RSS %7.1f MB (%6.1f MB per 100k)  ' \
+        'getsizeof %7.1f MB (%6.1f MB per 100k)' % (
+            result['items'], result['load_seconds'],
+            result['resident_bytes'] / 1048576.0,
+            result['resident_per_100k'] / 1048576.0,
+            result['estimated_bytes'] / 1048576.0,
+            result['estimated_per_100k'] / 1048576.0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read model memory use')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--items', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print json.dumps(measure(args.categories, args.items[0]))
+        sys.exit(0)
+    results = []
+    for items in args.items:
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child',
+             '--categories', str(args.categories), '--items', str(items)])
+        results.append(json.loads(output.splitlines()[-1]))
+    if args.json:
+        print json.dumps(results)
+    else:
+        for result in results:
+            report(result)
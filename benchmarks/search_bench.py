@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Measures full-text search latency against a naive LIKE scan.
+#
+# Usage, from the repository root:
+#   python benchmarks/search_bench.py [items ...]
+#
+# Each size (default 100000 and 1000000) gets a throwaway SQLite database
+# filled with random items, then typical full-word and type-ahead prefix
+# queries are timed through search.searchItems and through LIKE.
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from database_setup import Base, Category, Item, User  # noqa: E402
+from search import ensureSearchIndex, searchItems  # noqa: E402
+
+QUERIES = ['ball', 'soc', 'red runner', 'wat', 'glove leather']
+LIKE_SEARCH = ('SELECT id FROM item WHERE name LIKE :pattern '
+               'OR description LIKE :pattern')
+
+
+def vocabulary(size=5000):
+    """ Builds a word list that contains the benchmark query words """
+    words = set(['ball', 'soccer', 'red', 'runner', 'water', 'glove',
+                 'leather', 'socket'])
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    while len(words) < size:
+        words.add(''.join(random.choice(letters)
+                          for n in range(random.randint(3, 9))))
+    return sorted(words)
+
+
+def fill(engine, count):
+    """ Inserts count random items spread over 50 categories """
+    words = vocabulary()
+    engine.execute(User.__table__.insert(),
+                   [{'name': 'bench', 'email': 'bench@example.com'}])
+    engine.execute(Category.__table__.insert(),
+                   [{'name': 'Category %d' % n} for n in range(50)])
+    batch = []
+    for n in range(count):
+        batch.append({
+            'name': ' '.join(random.sample(words, 3)),
+            'description': ' '.join(random.sample(words, 12)),
+            'category_id': n % 50 + 1,
+            'user_id': 1})
+        if len(batch) == 10000:
+            engine.execute(Item.__table__.insert(), batch)
+            batch = []
+    if batch:
+        engine.execute(Item.__table__.insert(), batch)
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def timeQuery(run, repeat):
+    """ Runs a query repeatedly and returns (p50, p95) in milliseconds """
+    samples = []
+    for n in range(repeat):
+        start = time.time()
+        run()
+        samples.append((time.time() - start) * 1000)
+    return percentile(samples, 0.5), percentile(samples, 0.95)
+
+
+def benchmark(count):
+    directory = tempfile.mkdtemp()
+    try:
+        engine = create_engine('sqlite:///' + os.path.join(directory, 's.db'))
+        Base.metadata.create_all(engine)
+        start = time.time()
+        fill(engine, count)
+        ensureSearchIndex(engine)
+        print '%d items loaded and indexed in %.1fs' % (
+            count, time.time() - start)
+        session = sessionmaker(bind=engine)()
+        for terms in QUERIES:
+            fts = timeQuery(lambda: searchItems(session, terms), 50)
+            pattern = '%' + terms.split()[0] + '%'
+            like = timeQuery(lambda: session.execute(
+                LIKE_SEARCH, {'pattern': pattern}).fetchall(), 5)
+            print '  %-14r fts p50 %7.2fms p95 %7.2fms | ' \
+                  'like p50 %8.2fms p95 %8.2fms' % ((terms,) + fts + like)
+        session.close()
+        engine.dispose()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    random.seed(1)
+    sizes = [int(size) for size in sys.argv[1:]] or [100000, 1000000]
+    for size in sizes:
+        benchmark(size)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# Measures what it costs a fresh worker to start and answer its first
+# requests.
+#
+# Usage, from the repository root:
+#   python benchmarks/startup.py [--runs N] [--json]
+#
+# Every measurement runs in a new process against the database set by
+# DATABASE_URL, or catalogwithusers.db. The process times importing the
+# application, create_app() and the first and second request to each page,
+# and reports whether the OAuth stack was imported. Three cases are run:
+# an empty template bytecode cache, a bytecode cache filled by an earlier
+# process, and WARM_UP=1 with warmUp() called before the first request,
+# as the gunicorn post_worker_init hook does.
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PAGES = ['/', '/catalog/Soccer/', '/login', '/catalog.json']
+LAZY_MODULES = ['oauth2client', 'httplib2', 'requests', 'google.auth']
+
+
+def measure(warm_up):
+    """ Starts the application in this process and times its first requests
+
+    Returns:
+        A dict of timings in seconds
+    """
+    started = time.time()
+    import application
+    imported = time.time()
+    app = application.create_app({'SECRET_KEY': 'startup'})
+    created = time.time()
+    result = {'import': imported - started,
+              'create_app': created - imported,
+              'lazy_modules_loaded': [name for name in LAZY_MODULES
+                                      if name in sys.modules]}
+    if warm_up:
+        result['warm_up'] = application.warmUp()['seconds']
+    client = app.test_client()
+    for page in PAGES:
+        timings = []
+        for attempt in range(2):
+            start = time.time()
+            client.get(page, buffered=True)
+            timings.append(time.time() - start)
+        result[page] = timings
+    result['ready'] = time.time() - started
+    return result
+
+
+def child(cache_dir, warm_up):
+    """ Runs one measurement in a new process """
+    environ = dict(os.environ, TEMPLATE_CACHE_DIR=cache_dir,
+                   TEMPLATE_BYTECODE_CACHE='1', PAGE_CACHE_BACKEND='none',
+                   WARM_UP='1' if warm_up else '0')
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child'] +
+        (['--warm-up'] if warm_up else []), env=environ, cwd=ROOT)
+    return json.loads(output.splitlines()[-1])
+
+
+def average(results):
+    keys = [key for key in results[0] if key != 'lazy_modules_loaded']
+    merged = {'lazy_modules_loaded': results[0]['lazy_modules_loaded']}
+    for key in keys:
+        if isinstance(results[0][key], list):
+            merged[key] = [sum(result[key][n] for result in results) /
+                           len(results) for n in range(2)]
+        else:
+            merged[key] = sum(result[key] for result in results) / len(results)
+    return merged
+
+
+def report(name, result):
+    print name
+    print '  import %8.1f ms   create_app %8.1f ms' % (
+        result['import'] * 1000, result['create_app'] * 1000)
+    if 'warm_up' in result:
+        print '  warmUp %8.1f ms' % (result['warm_up'] * 1000)
+    for page in PAGES:
+        first, second = result[page]
+        print '  %-20s first %8.1f ms   second %8.1f ms' % (
+            page, first * 1000, second * 1000)
+    print '  ready after        %8.1f ms' % (result['ready'] * 1000)
+    print '  OAuth modules imported: %s' % (
+        ', '.join(result['lazy_modules_loaded']) or 'none')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Worker startup cost')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='processes started per case')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--warm-up', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        os.chdir(ROOT)
+        print json.dumps(measure(args.warm_up))
+        sys.exit(0)
+    results = {}
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cold = []
+        for run in range(args.runs):
+            shutil.rmtree(cache_dir)
+            os.mkdir(cache_dir)
+            cold.append(child(cache_dir, False))
+        results['empty bytecode cache'] = average(cold)
+        results['filled bytecode cache'] = average(
+            [child(cache_dir, False) for run in range(args.runs)])
+        results['filled bytecode cache, warmed up'] = average(
+            [child(cache_dir, True) for run in range(args.runs)])
+    finally:
+        shutil.rmtree(cache_dir)
+    if args.json:
+        print json.dumps(results)
+    else:
+        for name in ('empty bytecode cache', 'filled bytecode cache',
+                     'filled bytecode cache, warmed up'):
+            report(name, results[name])
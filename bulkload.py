@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# Loads users, categories and items from CSV or JSON Lines files.
+#
+# Usage:
+#   python bulkload.py [--database URL] [--batch-size N] [--fast] FILE...
+#
+# Every record has a "type" of user, category or item:
+#   user:     name, email, picture
+#   category: name
+#   item:     name, description, category (a category name) and
+#             user (an email) or user_id
+# Files ending in .csv are read as CSV with a header row, anything else as
+# JSON Lines. Users and categories that already exist are left unchanged.
+import argparse
+import csv
+import json
+import sys
+import time
+from sqlalchemy import select
+from change_log import newEpoch
+from database_setup import Category, Item, User
+from db import createEngine, databaseURL
+from item_counts import recountItems
+
+# The pragmas relaxed by --fast, with the values used during the load
+FAST_PRAGMAS = [('synchronous', 'OFF'), ('journal_mode', 'MEMORY')]
+
+
+def readRecords(path):
+    """ Reads the records of one input file
+
+    Args:
+        path: a .csv file with a header row, or a JSON Lines file
+
+    Returns:
+        A generator of (line number, record dict) tuples
+    """
+    with open(path, 'rb') as source:
+        if path.endswith('.csv'):
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, dict(
+                    (key, value.decode('utf-8') or None)
+                    for key, value in row.items())
+        else:
+            for number, line in enumerate(source, 1):
+                if line.strip():
+                    yield number, json.loads(line)
+
+
+class BulkLoader(object):
+    """ Streams records into the database in large batched transactions
+
+    Category names and user emails are resolved to ids in memory, so an
+    item never costs a lookup query.
+    """
+
+    def __init__(self, connection, batch_size=5000, progress=None):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.progress = progress
+        self.pending = {'user': [], 'category': [], 'item': []}
+        self.category_ids = dict(
+            (row.name, row.id) for row in connection.execute(
+                select([Category.__table__.c.id, Category.__table__.c.name])))
+        self.user_ids = dict(
+            (row.email, row.id) for row in connection.execute(
+                select([User.__table__.c.id, User.__table__.c.email])))
+        self.loaded = 0
+        self.started = time.time()
+
+    def add(self, record, where):
+        """ Queues one record, flushing the batch when it is full
+
+        Args:
+            record: a dict with a type and the fields for that type
+            where: a description of the record's location for errors
+        """
+        kind = record.get('type')
+        if kind == 'user':
+            if record['email'] in self.user_ids:
+                return
+            self.user_ids[record['email']] = None
+            row = {'name': record['name'], 'email': record['email'],
+                   'picture': record.get('picture')}
+        elif kind == 'category':
+            if record['name'] in self.category_ids:
+                return
+            self.category_ids[record['name']] = None
+            row = {'name': record['name']}
+        elif kind == 'item':
+            if record.get('category') not in self.category_ids:
+                raise ValueError('%s: unknown category %r'
+                                 % (where, record.get('category')))
+            if record.get('user') is not None and \
+                    record['user'] not in self.user_ids:
+                raise ValueError('%s: unknown user %r'
+                                 % (where, record['user']))
+            row = record
+        else:
+            raise ValueError('%s: unknown record type %r' % (where, kind))
+        self.pending[kind].append(row)
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Inserts everything queued so far in a single transaction """
+        with self.connection.begin():
+            self.insertUsers()
+            self.insertCategories()
+            self.insertItems()
+
+    def insertUsers(self):
+        rows = self.pending['user']
+        if not rows:
+            return
+        table = User.__table__
+        self.connection.execute(table.insert(), rows)
+        emails = [row['email'] for row in rows]
+        for start in range(0, len(emails), 500):
+            query = select([table.c.id, table.c.email]).where(
+                table.c.email.in_(emails[start:start + 500]))
+            for row in self.connection.execute(query):
+                self.user_ids[row.email] = row.id
+        self.done('user')
+
+    def insertCategories(self):
+        rows = self.pending['category']
+        if not rows:
+            return
+        table = Category.__table__
+        self.connection.execute(table.insert(), rows)
+        names = [row['name'] for row in rows]
+        for start in range(0, len(names), 500):
+            query = select([table.c.id, table.c.name]).where(
+                table.c.name.in_(names[start:start + 500]))
+            for row in self.connection.execute(query):
+                self.category_ids[row.name] = row.id
+        self.done('category')
+
+    def insertItems(self):
+        records = self.pending['item']
+        if not records:
+            return
+        rows = []
+        for record in records:
+            user_id = record.get('user_id')
+            if user_id is not None:
+                user_id = int(user_id)
+            if record.get('user') is not None:
+                user_id = self.user_ids[record['user']]
+            rows.append({'name': record['name'],
+                         'description': record.get('description'),
+                         'category_id': self.category_ids[record['category']],
+                         'user_id': user_id})
+        self.connection.execute(Item.__table__.insert(), rows)
+        self.done('item')
+
+    def done(self, kind):
+        self.loaded += len(self.pending[kind])
+        self.pending[kind] = []
+        if self.progress is not None:
+            elapsed = time.time() - self.started
+            self.progress('%d rows loaded, %.0f rows/s'
+                          % (self.loaded, self.loaded / max(elapsed, 1e-6)))
+
+
+def load(engine, paths, batch_size=5000, fast=False, progress=None):
+    """ Loads every record in the given files
+
+    Args:
+        engine: the engine connected to the catalog database
+        paths: a list of input file paths
+        batch_size: number of rows of one type inserted per statement
+        fast: relax SQLite durability pragmas for the duration of the load
+        progress: a function called with a progress message after each batch
+
+    Returns:
+        The number of rows inserted
+    """
+    connection = engine.connect()
+    restore = []
+    try:
+        if fast and engine.dialect.name == 'sqlite':
+            for name, value in FAST_PRAGMAS:
+                previous = connection.execute('PRAGMA %s' % name).scalar()
+                restore.append((name, previous))
+                connection.execute('PRAGMA %s = %s' % (name, value))
+        loader = BulkLoader(connection, batch_size, progress)
+        for path in paths:
+            for number, record in readRecords(path):
+                loader.add(record, '%s:%d' % (path, number))
+        loader.flush()
+        recountItems(connection)
+        newEpoch(connection)
+        return loader.loaded
+    finally:
+        for name, previous in reversed(restore):
+            connection.execute('PRAGMA %s = %s' % (name, previous))
+        connection.close()
+
+
+def progressLine(message):
+    sys.stderr.write('\r' + message)
+    sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Bulk load users, categories and items')
+    parser.add_argument('files', nargs='+',
+                        help='CSV or JSON Lines files to load, in order')
+    parser.add_argument('--database', default=None,
+                        help='database URL (default: %s)' % databaseURL())
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--fast', action='store_true',
+                        help='relax SQLite synchronous and journal pragmas '
+                             'during the load')
+    args = parser.parse_args()
+    started = time.time()
+    loaded = load(createEngine(args.database), args.files,
+                  args.batch_size, args.fast, progressLine)
+    elapsed = time.time() - started
+    sys.stderr.write('\n')
+    print 'loaded %d rows in %.2fs (%.0f rows/s)' % (
+        loaded, elapsed, loaded / max(elapsed, 1e-6))
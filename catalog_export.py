@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+from itertools import groupby
+from operator import itemgetter
+from flask import json
+from database_setup import Category, Item
+
+
+def iterCatalogRows(session, batch_size=1000, category_ids=None):
+    """ Fetches every category together with its items in one query
+
+    Args:
+        session: the database session to query with
+        batch_size: number of rows fetched from the cursor at a time
+        category_ids: only fetch these categories, defaults to all
+
+    Returns:
+        A generator of (category_id, category_name, items) tuples ordered
+        by category id, where items is a list of serialized item dicts
+    """
+    rows = session.query(Category.id, Category.name,
+                         Item.id, Item.name, Item.description) \
+        .outerjoin(Item, Item.category_id == Category.id)
+    if category_ids is not None:
+        rows = rows.filter(Category.id.in_(list(category_ids)))
+    rows = rows.order_by(Category.id, Item.id).yield_per(batch_size)
+    for (category_id, category_name), group in groupby(
+            rows, key=itemgetter(0, 1)):
+        items = [{'item_id': row[2],
+                  'item_name': row[3],
+                  'item_description': row[4],
+                  'category_id': category_id}
+                 for row in group if row[2] is not None]
+        yield category_id, category_name, items
+
+
+def serializeCategory(category_id, category_name, items):
+    """ Encodes one category the same way Category.serialize is jsonified
+
+    Args:
+        category_id: the integer id of the category
+        category_name: the name of the category
+        items: a list of serialized item dicts
+
+    Returns:
+        A compact JSON string for the category
+    """
+    return json.dumps({'category_id': category_id,
+                       'category_name': category_name,
+                       'category_items': items},
+                      separators=(',', ':'))
+
+
+def iterCatalogJSON(session, batch_size=1000):
+    """ Streams the full catalog as the /catalog.json document
+
+    Only one category's items are held in memory at a time, so the peak
+    memory use does not grow with the size of the catalog.
+
+    Args:
+        session: the database session to query with
+        batch_size: number of rows fetched from the cursor at a time
+
+    Returns:
+        A generator of JSON text chunks
+    """
+    yield '{"category":['
+    separator = ''
+    for category in iterCatalogRows(session, batch_size):
+        yield separator + serializeCategory(*category)
+        separator = ','
+    yield ']}\n'
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+import calendar
+import math
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+from flask import request, make_response
+from flask import session as login_session
+
+
+class CatalogVersion(object):
+    """ Versions of the catalog, the same in every process
+
+    A version is the id of the newest change log row that touched the
+    catalog, a category or an item. Every process applies the same rows,
+    so an ETag handed out by one worker is confirmed by the others. What
+    has not changed since a process last reset its versions gets the log
+    position it reset at. Every ETag also carries the epoch stored with
+    the log, which is replaced when items are written without being
+    logged.
+
+    A worker only learns about a write once it reads the log, at most lag
+    seconds after it was committed. A Last-Modified date that a worker
+    which had not read it yet handed out is therefore never confirmed
+    until lag seconds after the write.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoch = ''
+        self.lag = 0
+        self.reset(0)
+
+    def reset(self, position, epoch=None):
+        """ Forgets every version
+
+        Args:
+            position: the id of the newest change log row already applied
+            epoch: the epoch of the change log, if it changed
+        """
+        with self.lock:
+            if epoch is not None:
+                self.epoch = epoch
+            self.position = position
+            self.started = time.time()
+            self.version = position
+            self.modified = self.started
+            self.stamps = {}
+
+    def bump(self, version, categories=(), items=()):
+        """ Records a write to the catalog
+
+        Args:
+            version: the id of the change log row of the write
+            categories: names of the categories the write touched
+            items: ids of the items the write touched
+        """
+        with self.lock:
+            self.version = version
+            self.modified = time.time()
+            stamp = (self.version, self.modified)
+            for name in categories:
+                self.stamps[('category', name)] = stamp
+            for item_id in items:
+                self.stamps[('item', int(item_id))] = stamp
+
+    def stamp(self, scope=None):
+        """ Gets the current version of the catalog or part of it
+
+        Args:
+            scope: None for the whole catalog, or a ('category', name)
+            or ('item', id) tuple
+
+        Returns:
+            A (version, modified timestamp) tuple
+        """
+        with self.lock:
+            if scope is None:
+                return self.version, self.modified
+            return self.stamps.get(scope, (self.position, self.started))
+
+    def conditional(self, scope=None, personal=False):
+        """ Decorates a view so it answers conditional GETs from versions
+
+        When the client's ETag or Last-Modified date is still current the
+        view is skipped entirely and a 304 is returned, so no database
+        work is done. Otherwise the view runs and its response gets the
+        validators attached.
+
+        Last-Modified only has whole seconds, so If-Modified-Since is
+        compared with the exact time of the last write plus lag, and the
+        date sent is rounded up to the next second only once that second
+        is over. A copy fetched between two writes in the same second is
+        therefore never confirmed as fresh.
+
+        Args:
+            scope: None for the whole catalog, or a function that maps the
+            view arguments to a scope accepted by stamp()
+            personal: True if the page differs for each logged in user
+
+        Returns:
+            The decorator
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                # Pending flash messages are rendered once, never cached
+                if '_flashes' in login_session:
+                    return view(**kwargs)
+                try:
+                    key = scope(**kwargs) if scope else None
+                except ValueError:
+                    return view(**kwargs)
+                version, modified = self.stamp(key)
+                modified += self.lag
+                etag = '%s-%d' % (self.epoch, version)
+                if personal:
+                    etag += '-%s' % login_session.get('user_id', 'anon')
+                if request.if_none_match:
+                    fresh = request.if_none_match.contains_weak(etag)
+                else:
+                    since = request.if_modified_since
+                    fresh = since is not None and \
+                        calendar.timegm(since.utctimetuple()) >= modified
+                modified = lastModified(modified)
+                if fresh:
+                    response = make_response('', 304)
+                else:
+                    response = make_response(view(**kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag)
+                response.last_modified = modified
+                response.cache_control.no_cache = True
+                if personal:
+                    response.vary.add('Cookie')
+                return response
+            return wrapper
+        return decorator
+
+
+def lastModified(modified, now=None):
+    """ Picks the Last-Modified date to send for a write at modified
+
+    Args:
+        modified: the time of the last write, in seconds since the epoch
+        now: the current time, defaults to time.time()
+
+    Returns:
+        A datetime in whole seconds: the second after modified if that
+        has already begun, so revalidating gets a 304, else the second of
+        modified itself, which a later write in it cannot be hidden behind
+    """
+    now = time.time() if now is None else now
+    rounded = math.ceil(modified)
+    if rounded > now:
+        rounded = math.floor(modified)
+    return datetime.utcfromtimestamp(int(rounded))
+
+
+def categoryScope(category_name, **kwargs):
+    return ('category', category_name)
+
+
+def itemScope(item_id, **kwargs):
+    return ('item', int(item_id))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from database_setup import Category
+
+CategoryEntry = namedtuple('CategoryEntry', ['id', 'name'])
+
+
+class CategoryIndex(object):
+    """ An immutable snapshot of the category table
+
+    Attributes:
+        categories: a tuple of CategoryEntry sorted by name
+        ids: a dict of category name to id
+        names: a dict of category id to name
+    """
+    __slots__ = ('categories', 'ids', 'names')
+
+    def __init__(self, categories):
+        self.categories = tuple(categories)
+        self.ids = dict((c.name, c.id) for c in self.categories)
+        self.names = dict((c.id, c.name) for c in self.categories)
+
+
+class CategoryCache(object):
+    """ Shares one CategoryIndex between all requests
+
+    The index is dropped whenever a session commits a category write. The
+    TTL bounds how long a write made by another process can go unseen.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.index = None
+        self.loaded = 0
+
+    def get(self, session):
+        """ Gets the category index, loading it when missing or expired
+
+        Args:
+            session: the database session to load the categories with
+
+        Returns:
+            A CategoryIndex
+        """
+        index = self.index
+        if index is not None and time.time() - self.loaded < self.ttl:
+            return index
+        with self.lock:
+            if self.index is None or time.time() - self.loaded >= self.ttl:
+                rows = session.query(Category.id, Category.name) \
+                    .order_by(Category.name).all()
+                self.index = CategoryIndex(CategoryEntry(*row) for row in rows)
+                self.loaded = time.time()
+            return self.index
+
+    def invalidate(self):
+        """ Drops the index so the next request reloads it """
+        self.index = None
+
+    def listen(self, session_factory):
+        """ Invalidates the cache whenever a category write is committed
+
+        Args:
+            session_factory: the sessionmaker used by the application
+        """
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(Category, name, self.categoryWritten)
+        event.listen(session_factory, 'after_commit', self.committed)
+        event.listen(session_factory, 'after_rollback', self.rolledBack)
+
+    def categoryWritten(self, mapper, connection, target):
+        object_session(target).info['categories_changed'] = True
+
+    def committed(self, session):
+        if session.info.pop('categories_changed', False):
+            self.invalidate()
+
+    def rolledBack(self, session):
+        session.info.pop('categories_changed', None)
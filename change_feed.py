@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+import json
+import threading
+import time
+from collections import deque
+
+
+class ChangeFeed(object):
+    """ A bounded ring buffer of the most recent item changes
+
+    Every create, edit or delete is published under the id of its row in
+    the change log, which is the same in every process. Clients pass the
+    id back as a cursor to resume without gaps, against any worker. A
+    client whose cursor has already fallen out of the buffer is told to
+    reset and reload instead; one whose cursor is ahead of this process
+    waits until the process has caught up with it.
+
+    The feed also keeps the newest items for the front page. That list
+    is reloaded from the database when a delete leaves it short and after
+    ttl seconds, which picks up items added by other processes.
+    """
+
+    def __init__(self, size=1000, latest=5, ttl=30):
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=size)
+        self.sequence = 0
+        self.latest_size = latest
+        self.latest = None
+        self.latest_loaded = 0
+        self.ttl = ttl
+
+    def resize(self, size):
+        """ Changes how many recent changes the feed keeps """
+        with self.condition:
+            self.events = deque(self.events, maxlen=size)
+
+    def restart(self, sequence):
+        """ Drops every change, so clients behind sequence reset
+
+        Args:
+            sequence: the id of the newest change in the change log
+        """
+        with self.condition:
+            self.events.clear()
+            self.sequence = max(self.sequence, sequence)
+            self.latest = None
+            self.condition.notify_all()
+
+    def publish(self, change_id, action, item):
+        """ Appends a change to the feed and wakes up waiting clients
+
+        Args:
+            change_id: the id of the change in the change log; a change
+            that is not newer than the last one published is ignored
+            action: 'create', 'edit' or 'delete'
+            item: the serialized item including its category_name
+        """
+        with self.condition:
+            if change_id <= self.sequence:
+                return
+            self.sequence = change_id
+            self.events.append({'id': self.sequence,
+                                'action': action,
+                                'item': item})
+            self.updateLatest(action, item)
+            self.condition.notify_all()
+
+    def updateLatest(self, action, item):
+        if self.latest is None:
+            return
+        latest = [entry for entry in self.latest
+                  if entry['item_id'] != item['item_id']]
+        if action == 'delete':
+            if len(latest) < len(self.latest):
+                self.latest = None
+            return
+        if action == 'create' or len(latest) < len(self.latest):
+            latest.append(item)
+        latest.sort(key=lambda entry: entry['item_id'], reverse=True)
+        self.latest = latest[:self.latest_size]
+
+    def changesSince(self, cursor):
+        """ Gets the changes after a cursor
+
+        Args:
+            cursor: the id of the last change the client has seen
+
+        Returns:
+            A (events, reset) tuple, reset is True when changes after the
+            cursor are no longer available
+        """
+        with self.condition:
+            return self.collect(cursor)
+
+    def collect(self, cursor):
+        oldest = self.events[0]['id'] if self.events else self.sequence + 1
+        if cursor < oldest - 1:
+            return [], True
+        return [event for event in self.events if event['id'] > cursor], False
+
+    def wait(self, cursor, timeout, poll=None, every=1.0):
+        """ Waits for changes after a cursor
+
+        Args:
+            cursor: the id of the last change the client has seen
+            timeout: the longest time to wait, in seconds
+            poll: a function called every few seconds while waiting, to
+            publish the changes made by other processes
+            every: how often to call poll, in seconds
+
+        Returns:
+            A (events, reset) tuple like changesSince; events is empty if
+            nothing changed before the timeout
+        """
+        deadline = time.time() + timeout
+        while True:
+            with self.condition:
+                remaining = deadline - time.time()
+                if self.sequence > cursor or remaining <= 0:
+                    return self.collect(cursor)
+                self.condition.wait(min(remaining, every) if poll
+                                    else remaining)
+            if poll is not None:
+                poll()
+
+    def latestItems(self, load):
+        """ Gets the newest items for the front page
+
+        Args:
+            load: a function that queries the newest items from the
+            database, newest first
+
+        Returns:
+            A list of serialized items including their category_name
+        """
+        with self.condition:
+            if (self.latest is not None and
+                    time.time() - self.latest_loaded < self.ttl):
+                return list(self.latest)
+            sequence = self.sequence
+        latest = load(self.latest_size)
+        with self.condition:
+            # A change published during the load may be missing from it
+            if self.sequence == sequence:
+                self.latest = latest
+                self.latest_loaded = time.time()
+            return list(latest)
+
+
+def serverSentEvents(feed, cursor, duration, heartbeat=15, poll=None):
+    """ Streams the changes after a cursor as Server-Sent Events
+
+    The stream ends after duration seconds; the browser then reconnects
+    with the Last-Event-ID of the last change it received.
+
+    Args:
+        feed: the ChangeFeed to read
+        cursor: the id of the last change the client has seen
+        duration: how long to keep the connection open, in seconds
+        heartbeat: the longest silence before a keep-alive comment
+        poll: passed on to ChangeFeed.wait
+
+    Returns:
+        A generator of event stream chunks
+    """
+    yield 'retry: 3000\n\n'
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        events, reset = feed.wait(cursor, min(heartbeat,
+                                              deadline - time.time()),
+                                  poll=poll)
+        if reset:
+            cursor = feed.sequence
+            yield 'id: %d\nevent: reset\ndata: {"cursor": %d}\n\n' % (
+                cursor, cursor)
+            continue
+        if not events:
+            yield ': keep-alive\n\n'
+        for event in events:
+            yield 'id: %d\nevent: %s\ndata: %s\n\n' % (
+                event['id'], event['action'], json.dumps(event['item']))
+            cursor = event['id']
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+import os
+import threading
+import time
+from binascii import hexlify
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database_setup import CatalogChange, CatalogChangeLock
+
+
+def randomEpoch():
+    return hexlify(os.urandom(4)).decode('ascii')
+
+
+def newEpoch(bind):
+    """ Replaces the epoch after items were written without being logged
+
+    Loaders that bypass the write routes call this when they are done, so
+    no ETag handed out before the load is confirmed afterwards.
+
+    Args:
+        bind: an engine or connection
+    """
+    table = CatalogChangeLock.__table__
+    bind.execute(table.update().values(epoch=randomEpoch()))
+
+
+def logPosition(session):
+    """ Gets the id of the newest change and the epoch of the log
+
+    Args:
+        session: the session to read with
+
+    Returns:
+        A (change id, epoch) tuple
+    """
+    position = session.query(func.max(CatalogChange.id)).scalar() or 0
+    return position, session.query(CatalogChangeLock.epoch).scalar()
+
+
+def changedCategories(session, position):
+    """ Finds the categories that items were written to after a change
+
+    Args:
+        session: the session to read with
+        position: the id of a change
+
+    Returns:
+        A set of category ids, or None when the log was pruned past
+        position and anything may have changed
+    """
+    oldest = session.query(func.min(CatalogChange.id)).scalar()
+    if oldest is not None and oldest > position + 1:
+        return None
+    category_ids = set()
+    for row in session.query(CatalogChange.category_id,
+                             CatalogChange.old_category_id) \
+            .filter(CatalogChange.id > position):
+        category_ids.update(row)
+    category_ids.discard(None)
+    return category_ids
+
+
+class ChangeLog(object):
+    """ The log of item writes that every process follows
+
+    Every write adds a row per item it touched to the catalog_change
+    table, in its own transaction, with what the item looks like after it.
+    Each process reads the rows in id order, its own included: right after
+    each of its writes, and at most every check_seconds while it answers
+    reads. That is how the versions, cached pages, change feed and read
+    model of one worker learn about the writes made by the others. Only
+    the last size rows are kept. The log is read through the read engine,
+    so a process never waits for another thread's read while it holds the
+    write lock.
+
+    Before it logs anything a write updates the catalog_change_lock row,
+    whose lock it then holds until it commits. No two writes can take log
+    ids at the same time, so a smaller id is never committed after a
+    larger one and asking for the ids above the newest one seen misses
+    nothing, even on PostgreSQL where sequences are not transactional.
+    """
+
+    def __init__(self, check_seconds=1.0, size=10000):
+        self.check_seconds = check_seconds
+        self.size = size
+        self.seen = 0
+        self.epoch = None
+        self.reader = None
+        self.checked = 0
+        self.recorded = 0
+        self.lock = threading.Lock()
+
+    def init_app(self, engine, read_engine=None):
+        """ Inserts the lock row if it is missing and skips the old changes
+
+        Args:
+            engine: the engine of the catalog database
+            read_engine: the engine to read the log with, defaults to engine
+        """
+        lock = CatalogChangeLock.__table__
+        try:
+            with engine.begin() as connection:
+                if connection.execute(select([lock.c.id])).first() is None:
+                    connection.execute(lock.insert(), id=1, writes=0,
+                                       epoch=randomEpoch())
+                connection.execute(lock.update().where(
+                    lock.c.epoch.is_(None)).values(epoch=randomEpoch()))
+        except IntegrityError:
+            pass  # another process inserted it first
+        self.epoch = engine.execute(select([lock.c.epoch])).scalar()
+        table = CatalogChange.__table__
+        self.seen = engine.execute(
+            select([func.max(table.c.id)])).scalar() or 0
+        self.reader = read_engine or engine
+
+    def record(self, session, changes):
+        """ Logs item writes in their transaction
+
+        Args:
+            session: the session the items were written in, before commit
+            changes: a list of (action, item, old_category_id) tuples
+        """
+        if not changes:
+            return
+        session.flush()
+        lock = CatalogChangeLock.__table__
+        session.execute(lock.update().values(writes=lock.c.writes + 1))
+        table = CatalogChange.__table__
+        session.execute(table.insert(), [
+            {'item_id': item.id,
+             'action': action,
+             'category_id': item.category_id,
+             'old_category_id': old_category_id,
+             'name': item.name,
+             'description': item.description,
+             'user_id': item.user_id}
+            for action, item, old_category_id in changes])
+        self.recorded += len(changes)
+        if self.recorded >= max(self.size // 10, 1):
+            self.recorded = 0
+            newest = session.query(func.max(CatalogChange.id)).scalar()
+            session.execute(table.delete().where(
+                table.c.id <= newest - self.size))
+
+    def catchUp(self, apply, wait=False):
+        """ Hands the changes logged since the last call to apply
+
+        One thread reads the log at a time. Unless wait is set the log is
+        only read when check_seconds have passed since the last read and
+        no other thread is reading it. Callers must not hold a write
+        transaction, least of all when they wait.
+
+        Args:
+            apply: a function taking the list of new CatalogChange rows in
+            id order, which may be empty, and whether the list is complete;
+            it is not when the log was pruned past the newest change seen
+            or the epoch was replaced, which epoch then holds
+            wait: True to wait for another thread and read the log even if
+            no read is due, as after a write of this process
+        """
+        if not wait and time.time() - self.checked < self.check_seconds:
+            return
+        if not self.lock.acquire(wait):
+            return
+        reader = Session(bind=self.reader)
+        previous = self.epoch
+        try:
+            self.epoch = reader.query(CatalogChangeLock.epoch).scalar()
+            changes = reader.query(CatalogChange) \
+                .filter(CatalogChange.id > self.seen) \
+                .order_by(CatalogChange.id).all()
+            complete = self.epoch == previous and (
+                not changes or changes[0].id == self.seen + 1 or
+                reader.query(func.min(CatalogChange.id)).scalar() <=
+                self.seen)
+            reader.close()
+            apply(changes, complete)
+            if changes:
+                self.seen = changes[-1].id
+        except Exception:
+            self.epoch = previous
+            raise
+        finally:
+            reader.close()
+            self.checked = time.time()
+            self.lock.release()
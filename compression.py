@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('text/html', 'text/css', 'text/plain', 'text/xml',
+                'application/json', 'application/javascript',
+                'image/svg+xml')
+
+
+def encodings():
+    """ Lists the content codings this process can produce, best first """
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(available):
+    """ Picks the content coding to send from the request's Accept-Encoding
+
+    Args:
+        available: the codings the response can be sent in, best first
+
+    Returns:
+        'br', 'gzip' or None to send the response as it is
+    """
+    best, quality = None, 0
+    for encoding in available:
+        accepted = request.accept_encodings[encoding]
+        if accepted > quality:
+            best, quality = encoding, accepted
+    return best
+
+
+def compress(data, encoding, level):
+    """ Compresses a whole body
+
+    Args:
+        data: the bytes to compress
+        encoding: 'br' or 'gzip'
+        level: the gzip level, or the brotli quality
+
+    Returns:
+        The compressed bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compressChunks(chunks, encoding, level):
+    """ Compresses a streamed body chunk by chunk
+
+    Args:
+        chunks: an iterable of bytes
+        encoding: 'br' or 'gzip'
+        level: the gzip level, or the brotli quality
+
+    Returns:
+        A generator of compressed chunks
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+class Compression(object):
+    """ Compresses dynamic responses for clients that accept it
+
+    HTML, JSON and other text responses of at least min_size bytes are
+    sent with brotli when the client accepts it and the brotli package is
+    installed, or with gzip otherwise. Streamed responses are compressed
+    as they are sent. Event streams, responses that already have a
+    Content-Encoding and files sent from disk are left alone.
+    """
+
+    def __init__(self, min_size=500, gzip_level=6, brotli_quality=4):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def init_app(self, app):
+        """ Installs the response hook
+
+        Args:
+            app: the Flask application
+        """
+        app.after_request(self.compressResponse)
+
+    def compressResponse(self, response):
+        if (response.mimetype not in COMPRESSIBLE or
+                not 200 <= response.status_code < 300 or
+                response.direct_passthrough or
+                'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        streamed = response.is_streamed
+        if not streamed and (response.content_length or 0) < self.min_size:
+            return response
+        encoding = negotiate(encodings())
+        if encoding is None:
+            return response
+        level = self.brotli_quality if encoding == 'br' else self.gzip_level
+        if streamed:
+            response.response = compressChunks(response.response, encoding,
+                                               level)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compress(response.get_data(), encoding, level))
+        response.headers['Content-Encoding'] = encoding
+        # The compressed bytes differ from the plain ones
+        if response.headers.get('ETag'):
+            etag, weak = response.get_etag()
+            response.set_etag(etag, weak=True)
+        return response
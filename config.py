@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+import os
+
+
+def envStr(name, default=None):
+    """ Reads a string setting from the environment
+
+    Args:
+        name: the environment variable name
+        default: the value used when the variable is unset or empty
+
+    Returns:
+        The setting as a string
+    """
+    return os.environ.get(name) or default
+
+
+def envInt(name, default):
+    """ Reads an integer setting from the environment """
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def envFloat(name, default):
+    """ Reads a floating point setting from the environment """
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def envBool(name, default):
+    """ Reads a boolean setting from the environment
+
+    1, true, yes and on (in any case) are true, anything else is false.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def loadConfig():
+    """ Reads the application settings from the environment
+
+    Returns:
+        A dict of Flask config keys to values
+    """
+    return {
+        'SECRET_KEY': envStr('SECRET_KEY'),
+        'DEBUG': envBool('FLASK_DEBUG', False),
+        'DATABASE_URL': envStr('DATABASE_URL'),
+        'DATABASE_READ_URL': envStr('DATABASE_READ_URL'),
+        'CATALOG_JSON_STREAMING': envBool('CATALOG_JSON_STREAMING', True),
+        'CATALOG_JSON_BATCH_SIZE': envInt('CATALOG_JSON_BATCH_SIZE', 1000),
+        'PAGE_SIZE': envInt('PAGE_SIZE', 50),
+        'MAX_PAGE_SIZE': envInt('MAX_PAGE_SIZE', 200),
+        'MULTI_GET_MAX_IDS': envInt('MULTI_GET_MAX_IDS', 500),
+        'READ_MODEL': envBool('READ_MODEL', False),
+        'READ_MODEL_RELOAD_SECONDS': envFloat('READ_MODEL_RELOAD_SECONDS',
+                                              3600),
+        'CHANGE_LOG_CHECK_SECONDS': envFloat('CHANGE_LOG_CHECK_SECONDS', 1.0),
+        'CHANGE_LOG_SIZE': envInt('CHANGE_LOG_SIZE', 10000),
+        'WRITE_QUEUE': envBool('WRITE_QUEUE', False),
+        'WRITE_QUEUE_WINDOW': envFloat('WRITE_QUEUE_WINDOW', 0.002),
+        'WRITE_QUEUE_MAX_BATCH': envInt('WRITE_QUEUE_MAX_BATCH', 64),
+        'SNAPSHOT_DIR': envStr('SNAPSHOT_DIR'),
+        'SNAPSHOT_MSGPACK': envBool('SNAPSHOT_MSGPACK', True),
+        'SNAPSHOT_DELAY': envFloat('SNAPSHOT_DELAY', 1.0),
+        'CATEGORY_CACHE_TTL': envInt('CATEGORY_CACHE_TTL', 60),
+        'BATCH_MAX_OPERATIONS': envInt('BATCH_MAX_OPERATIONS', 500),
+        'IDEMPOTENCY_KEY_TTL': envInt('IDEMPOTENCY_KEY_TTL', 86400),
+        'CHANGE_FEED_SIZE': envInt('CHANGE_FEED_SIZE', 1000),
+        'CHANGE_FEED_STREAM_SECONDS': envInt('CHANGE_FEED_STREAM_SECONDS',
+                                             300),
+        'CHANGE_FEED_CONNECTIONS': envInt('CHANGE_FEED_CONNECTIONS', 16),
+        'PAGE_CACHE_BACKEND': envStr('PAGE_CACHE_BACKEND', 'memory'),
+        'PAGE_CACHE_SIZE': envInt('PAGE_CACHE_SIZE', 1024),
+        'PAGE_CACHE_TTL': envInt('PAGE_CACHE_TTL', 300),
+        'REDIS_URL': envStr('REDIS_URL'),
+        'COMPRESS_MIN_SIZE': envInt('COMPRESS_MIN_SIZE', 500),
+        'COMPRESS_GZIP_LEVEL': envInt('COMPRESS_GZIP_LEVEL', 6),
+        'COMPRESS_BROTLI_QUALITY': envInt('COMPRESS_BROTLI_QUALITY', 4),
+        'LOG_LEVEL': envStr('LOG_LEVEL', 'INFO'),
+        'SLOW_QUERY_SECONDS': envFloat('SLOW_QUERY_SECONDS', 0.1),
+        'QUERY_COUNT_HEADER': envBool('QUERY_COUNT_HEADER', False),
+        'PROFILE_DIR': envStr('PROFILE_DIR', 'profiles'),
+        'PROFILE_SAMPLE_RATE': envFloat('PROFILE_SAMPLE_RATE', 0.0),
+        'PROFILE_TOKEN': envStr('PROFILE_TOKEN'),
+        'PROFILE_MAX_FILES': envInt('PROFILE_MAX_FILES', 200),
+        'ADMISSION_CONTROL': envBool('ADMISSION_CONTROL', True),
+        'ADMISSION_LIMITS': envStr('ADMISSION_LIMITS'),
+        'TEMPLATE_BYTECODE_CACHE': envBool('TEMPLATE_BYTECODE_CACHE', True),
+        'TEMPLATE_CACHE_DIR': envStr('TEMPLATE_CACHE_DIR'),
+        'WARM_UP': envBool('WARM_UP', False),
+        'WARM_UP_CONNECTIONS': envInt('WARM_UP_CONNECTIONS', 0),
+        'GOOGLE_CLIENT_SECRETS': envStr('GOOGLE_CLIENT_SECRETS',
+                                        'client_secrets.json'),
+        'GOOGLE_TOKEN_URI': envStr('GOOGLE_TOKEN_URI'),
+        'GOOGLE_TOKENINFO_URI': envStr('GOOGLE_TOKENINFO_URI'),
+        'GOOGLE_USERINFO_URI': envStr('GOOGLE_USERINFO_URI'),
+        'GOOGLE_REVOKE_URI': envStr('GOOGLE_REVOKE_URI'),
+        'GOOGLE_CERTS_URI': envStr('GOOGLE_CERTS_URI'),
+        'GOOGLE_HTTP_TIMEOUT': envFloat('GOOGLE_HTTP_TIMEOUT', 5),
+        'GOOGLE_VERIFY_ID_TOKEN': envBool('GOOGLE_VERIFY_ID_TOKEN', True),
+    }
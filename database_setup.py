@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 import os
 import sys
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import create_engine
+from db import databaseURL
 
 Base = declarative_base()
 
@@ -12,15 +14,18 @@ Base = declarative_base()
 class User(Base):
     __tablename__ = 'user'
     name = Column(String(80), nullable=False)
-    email = Column(String(80), nullable=False)
+    email = Column(String(80), nullable=False, unique=True, index=True)
     picture = Column(String(80))
     id = Column(Integer, primary_key=True)
 
 
 class Category(Base):
     __tablename__ = 'category'
-    name = Column(String(80), nullable=False)
+    name = Column(String(80), nullable=False, unique=True, index=True)
     id = Column(Integer, primary_key=True)
+    # Kept up to date by the write routes, see item_counts.py
+    item_count = Column(Integer, nullable=False, default=0,
+                        server_default='0')
     items = relationship("Item")
 
     @property
@@ -38,7 +43,7 @@ class Item(Base):
     name = Column(String(80), nullable=False)
     id = Column(Integer, primary_key=True)
     description = Column(String(250))
-    category_id = Column(Integer, ForeignKey('category.id'))
+    category_id = Column(Integer, ForeignKey('category.id'), index=True)
     category = relationship(Category, back_populates='items')
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship(User)
@@ -54,7 +59,58 @@ class Item(Base):
         }
 
 
-engine = create_engine('sqlite:///catalogwithusers.db')
+class BatchRequest(Base):
+    """ The stored response of a batch write, looked up by its key """
+    __tablename__ = 'batch_request'
+    __table_args__ = (UniqueConstraint('user_id', 'key'),)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    key = Column(String(255), nullable=False)
+    fingerprint = Column(String(64), nullable=False)
+    response = Column(Text, nullable=False)
+    created = Column(DateTime, nullable=False, index=True)
+
+
+class CatalogChange(Base):
+    """ One item write and what the item looked like after it
+
+    Every process reads these rows in id order to learn about the writes
+    made by the others.
+    """
+    __tablename__ = 'catalog_change'
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, nullable=False)
+    action = Column(String(6), nullable=False, server_default='edit')
+    category_id = Column(Integer)
+    old_category_id = Column(Integer)
+    name = Column(String(80))
+    description = Column(String(250))
+    user_id = Column(Integer)
+
+    @property
+    def serialize(self):
+        """ The item as Item.serialize gives it """
+        return {
+            'item_id': self.item_id,
+            'item_name': self.name,
+            'item_description': self.description,
+            'category_id': self.category_id
+        }
+
+
+class CatalogChangeLock(Base):
+    """ The one row a write updates before it logs its changes
+
+    The update holds the row's lock until the write commits, so the ids of
+    catalog_change rows are taken, and become visible, in commit order.
+    The epoch goes into every ETag and is replaced whenever items are
+    written without being logged.
+    """
+    __tablename__ = 'catalog_change_lock'
+    id = Column(Integer, primary_key=True)
+    writes = Column(Integer, nullable=False, default=0)
+    epoch = Column(String(8))
 
 
-Base.metadata.create_all(engine)
+if __name__ == '__main__':
+    Base.metadata.create_all(create_engine(databaseURL()))
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from config import envBool, envInt, envStr
+
+DEFAULT_DATABASE_URL = 'sqlite:///catalogwithusers.db'
+
+
+class RoutingSession(Session):
+    """ A session that reads from the read engine until it is told to write
+
+    Sessions start on the read engine. Views that change data call
+    useWriter() before their first query, so their reads and writes share
+    one transaction on the write engine, and useReader() once it has
+    committed. A flush from a session that was not switched still goes to
+    the write engine.
+    """
+
+    def __init__(self, writer=None, reader=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.writer = writer
+        self.reader = reader
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.writer is None:
+            return super(RoutingSession, self).get_bind(mapper, clause)
+        if self.reader is None or self.info.get('writer') or self._flushing:
+            return self.writer
+        return self.reader
+
+
+# One session per thread; the application removes it when each request ends
+DBSession = sessionmaker(class_=RoutingSession)
+session = scoped_session(DBSession)
+
+
+def useWriter():
+    """ Routes the rest of this thread's session to the write engine """
+    session().info['writer'] = True
+
+
+def useReader():
+    """ Routes this thread's session back to the read engine
+
+    A write transaction on SQLite holds the database-wide write lock, so
+    the reads a request makes after committing its write go to the read
+    engine instead of opening another one.
+    """
+    session().info.pop('writer', None)
+
+
+def databaseURL():
+    """ Gets the database URL, DATABASE_URL overrides the local SQLite file """
+    return envStr('DATABASE_URL', DEFAULT_DATABASE_URL)
+
+
+def poolOptions():
+    """ Builds the connection pool settings from the environment
+
+    Returns:
+        A dict of keyword arguments for create_engine
+    """
+    return {
+        'pool_size': envInt('DB_POOL_SIZE', 5),
+        'max_overflow': envInt('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': envInt('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': envInt('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': envBool('DB_POOL_PRE_PING', True),
+    }
+
+
+def sqlitePragmas():
+    """ Builds the pragmas set on every SQLite connection
+
+    WAL lets readers keep reading while a write is committed, busy_timeout
+    makes a blocked writer wait instead of failing at once, and NORMAL
+    synchronous is durable enough in WAL mode while syncing far less.
+
+    Returns:
+        A list of (pragma, value) tuples
+    """
+    return [
+        ('journal_mode', envStr('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('busy_timeout', envInt('SQLITE_BUSY_TIMEOUT', 5000)),
+        ('synchronous', envStr('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('cache_size', envInt('SQLITE_CACHE_SIZE', -20000)),
+        ('mmap_size', envInt('SQLITE_MMAP_SIZE', 268435456)),
+    ]
+
+
+def tuneSQLite(engine, read_only=False):
+    """ Applies the pragmas and transaction mode to an SQLite engine
+
+    The sqlite3 module only opens a transaction before the first write,
+    which lets two writers both read and then deadlock upgrading their
+    locks. Transactions on the write engine therefore start with BEGIN
+    IMMEDIATE, which takes the write lock up front. Connections of a read
+    engine are query only.
+
+    Args:
+        engine: the SQLite engine
+        read_only: True for an engine that only serves reads
+    """
+    pragmas = sqlitePragmas()
+    if read_only:
+        pragmas.append(('query_only', 'ON'))
+
+    @event.listens_for(engine, 'connect')
+    def connected(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.execute('BEGIN' if read_only else 'BEGIN IMMEDIATE')
+
+
+def createEngine(url=None, read_only=False):
+    """ Creates a pooled engine for the catalog database
+
+    SQLite connections are pooled as well, so they have to be allowed to
+    move between the threads that check them out.
+
+    Args:
+        url: the database URL, defaults to databaseURL()
+        read_only: True for an engine that only serves reads
+
+    Returns:
+        A sqlalchemy Engine
+    """
+    url = url or databaseURL()
+    options = poolOptions()
+    if url.startswith('sqlite'):
+        options['poolclass'] = QueuePool
+        options['connect_args'] = {'check_same_thread': False}
+    engine = create_engine(url, **options)
+    if engine.dialect.name == 'sqlite':
+        tuneSQLite(engine, read_only)
+    return engine
+
+
+def createEngines(url=None, read_url=None):
+    """ Creates the write engine and the engine that serves reads
+
+    Reads go to read_url when it is set, such as a PostgreSQL replica.
+    Otherwise an SQLite file gets a second, query only engine whose
+    connections read in parallel with the writer, and other databases
+    share one engine.
+
+    Args:
+        url: the database URL, defaults to databaseURL()
+        read_url: the URL of a database to read from, optional
+
+    Returns:
+        A (write engine, read engine) tuple, possibly the same engine twice
+    """
+    writer = createEngine(url)
+    if read_url:
+        return writer, createEngine(read_url, read_only=True)
+    database = writer.url.database
+    if writer.dialect.name == 'sqlite' and database and \
+            database != ':memory:':
+        return writer, createEngine(str(writer.url), read_only=True)
+    return writer, writer
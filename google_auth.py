@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+import json
+import re
+import threading
+import time
+
+TOKENINFO_URI = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
+USERINFO_URI = 'https://www.googleapis.com/oauth2/v1/userinfo'
+REVOKE_URI = 'https://accounts.google.com/o/oauth2/revoke'
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+class GoogleAuth(object):
+    """ Talks to Google's OAuth endpoints for the login and logout views
+
+    The client secrets are parsed once, outbound calls share pooled
+    connections with timeouts, verified tokens are cached until they
+    expire and ID tokens are checked locally against Google's cached
+    signing certificates, which saves the tokeninfo round trip on most
+    logins. Every endpoint can be overridden to point at a stand-in server.
+
+    oauth2client, httplib2, requests and google.auth are only imported when
+    the first login or logout needs them, so they add nothing to the time
+    it takes a worker to start.
+    """
+
+    def __init__(self, secrets_path, token_uri=None, tokeninfo_uri=None,
+                 userinfo_uri=None, revoke_uri=None, certs_uri=None,
+                 timeout=5, verify_id_token=True):
+        with open(secrets_path, 'r') as secrets_file:
+            secrets = json.load(secrets_file)['web']
+        self.client_id = secrets['client_id']
+        self.secrets = secrets
+        self.token_uri = token_uri or secrets['token_uri']
+        self.tokeninfo_uri = tokeninfo_uri or TOKENINFO_URI
+        self.userinfo_uri = userinfo_uri or USERINFO_URI
+        self.revoke_uri = revoke_uri or REVOKE_URI
+        self.certs_uri = certs_uri or secrets['auth_provider_x509_cert_url']
+        self.timeout = timeout
+        self.verify_id_token = verify_id_token
+        self._flow = None
+        self._http = None
+        # oauth2client needs httplib2, whose connections are not thread safe
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.certs = None
+        self.certs_expire = 0
+
+    @property
+    def flow(self):
+        """ The oauth2client flow that exchanges authorization codes """
+        if self._flow is None:
+            from oauth2client.client import OAuth2WebServerFlow
+            with self.lock:
+                if self._flow is None:
+                    self._flow = OAuth2WebServerFlow(
+                        client_id=self.secrets['client_id'],
+                        client_secret=self.secrets['client_secret'],
+                        scope='',
+                        redirect_uri='postmessage',
+                        auth_uri=self.secrets['auth_uri'],
+                        token_uri=self.token_uri)
+        return self._flow
+
+    @property
+    def http(self):
+        """ The pooled requests session used for every other call """
+        if self._http is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            with self.lock:
+                if self._http is None:
+                    http = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+                    http.mount('https://', adapter)
+                    http.mount('http://', adapter)
+                    self._http = http
+        return self._http
+
+    def flowHttp(self):
+        http = getattr(self.local, 'http', None)
+        if http is None:
+            import httplib2
+            http = self.local.http = httplib2.Http(timeout=self.timeout)
+        return http
+
+    def exchange(self, code):
+        """ Upgrades a one-time authorization code into credentials
+
+        Args:
+            code: the authorization code sent by the login page
+
+        Returns:
+            oauth2client credentials; raises FlowExchangeError on failure
+        """
+        return self.flow.step2_exchange(code, http=self.flowHttp())
+
+    def tokenInfo(self, credentials):
+        """ Verifies the access token of freshly exchanged credentials
+
+        Args:
+            credentials: the credentials returned by exchange()
+
+        Returns:
+            A dict shaped like Google's tokeninfo response, with user_id and
+            issued_to, or with an error
+        """
+        access_token = credentials.access_token
+        now = time.time()
+        with self.lock:
+            info, expires = self.tokens.get(access_token, (None, 0))
+        if info is not None and expires > now:
+            return info
+        info = None
+        id_token = (credentials.token_response or {}).get('id_token')
+        if self.verify_id_token and id_token:
+            info = self.verifyIdToken(id_token)
+        if info is None:
+            info = self.http.get(self.tokeninfo_uri,
+                                 params={'access_token': access_token},
+                                 timeout=self.timeout).json()
+        if info.get('error') is None:
+            expires_in = info.get('expires_in') or \
+                (credentials.token_response or {}).get('expires_in', 0)
+            with self.lock:
+                self.forgetExpired(now)
+                self.tokens[access_token] = (info, now + int(expires_in))
+        return info
+
+    def verifyIdToken(self, id_token):
+        """ Checks an ID token's signature, audience and issuer locally
+
+        Args:
+            id_token: the encoded JWT from the token response
+
+        Returns:
+            The token's claims as tokeninfo fields, or None if the token
+            could not be verified locally
+        """
+        import requests
+        from google.auth import exceptions as google_exceptions
+        from google.auth import jwt
+        try:
+            claims = jwt.decode(id_token, certs=self.signingCerts(),
+                                audience=self.client_id)
+        except (ValueError, requests.RequestException,
+                google_exceptions.GoogleAuthError):
+            return None
+        if claims.get('iss') not in ISSUERS:
+            return None
+        return {'user_id': claims['sub'],
+                'issued_to': claims.get('azp', claims['aud']),
+                'email': claims.get('email'),
+                'expires_in': int(claims['exp'] - time.time())}
+
+    def signingCerts(self):
+        """ Gets Google's token signing certificates, cached per max-age """
+        if self.certs is not None and self.certs_expire > time.time():
+            return self.certs
+        response = self.http.get(self.certs_uri, timeout=self.timeout)
+        response.raise_for_status()
+        max_age = MAX_AGE.search(response.headers.get('Cache-Control', ''))
+        self.certs = response.json()
+        self.certs_expire = time.time() + (
+            int(max_age.group(1)) if max_age else 3600)
+        return self.certs
+
+    def forgetExpired(self, now):
+        for token in [token for token, (info, expires) in self.tokens.items()
+                      if expires <= now]:
+            del self.tokens[token]
+
+    def userInfo(self, access_token):
+        """ Gets the name, picture and email of the logged in user """
+        response = self.http.get(self.userinfo_uri,
+                                 params={'access_token': access_token,
+                                         'alt': 'json'},
+                                 timeout=self.timeout)
+        return response.json()
+
+    def revoke(self, access_token):
+        """ Revokes an access token
+
+        Returns:
+            True if Google accepted the revocation
+        """
+        with self.lock:
+            self.tokens.pop(access_token, None)
+        response = self.http.get(self.revoke_uri,
+                                 params={'token': access_token},
+                                 timeout=self.timeout)
+        return response.status_code == 200
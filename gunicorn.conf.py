@@ -0,0 +1,43 @@
+# Settings for serving the catalog with gunicorn:
+#   gunicorn -c gunicorn.conf.py wsgi:application
+#
+# The application is loaded once in the master and workers are forked from
+# it, so they share the imported code and templates. Each worker keeps its
+# own caches and follows the writes of the others through the change log.
+# Every setting can be changed through the environment.
+import multiprocessing
+import os
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             multiprocessing.cpu_count() * 2 + 1))
+# Threads keep the change feed's long-lived requests from tying up workers.
+# Every open feed connection holds a thread, so the feed gets threads of its
+# own on top of the WEB_THREADS that serve the pages.
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4)) + \
+    int(os.environ.get('CHANGE_FEED_CONNECTIONS', 16))
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 0))
+preload_app = True
+accesslog = os.environ.get('WEB_ACCESS_LOG')
+errorlog = '-'
+
+
+def pre_fork(server, worker):
+    import application
+    application.beforeFork()
+
+
+def post_fork(server, worker):
+    import application
+    application.afterFork()
+
+
+def post_worker_init(worker):
+    import application
+    if application.app.config.get('WARM_UP'):
+        application.warmUp()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+from sqlalchemy import func, select
+from database_setup import Category, Item
+
+
+def countDeltas(changes):
+    """ Works out how item writes change the size of each category
+
+    Args:
+        changes: a list of (action, item, old_category_id) tuples, as taken
+        by application.itemsChanged
+
+    Returns:
+        A dict of category ids to the change of their item count
+    """
+    deltas = {}
+    for action, item, old_category_id in changes:
+        category_id = int(item.category_id)
+        if action == 'create':
+            deltas[category_id] = deltas.get(category_id, 0) + 1
+        elif action == 'delete':
+            deltas[category_id] = deltas.get(category_id, 0) - 1
+        elif old_category_id is not None and old_category_id != category_id:
+            deltas[category_id] = deltas.get(category_id, 0) + 1
+            deltas[old_category_id] = deltas.get(old_category_id, 0) - 1
+    return dict((category_id, delta) for category_id, delta
+                in deltas.items() if delta)
+
+
+def adjustItemCounts(session, changes):
+    """ Updates the stored item counts in the transaction of the writes
+
+    Args:
+        session: the session the items were written in, before commit
+        changes: a list of (action, item, old_category_id) tuples
+    """
+    table = Category.__table__
+    for category_id, delta in sorted(countDeltas(changes).items()):
+        session.execute(table.update()
+                        .where(table.c.id == category_id)
+                        .values(item_count=table.c.item_count + delta))
+
+
+def itemCount(session, category_id=None):
+    """ Reads the stored number of items in one category or in all of them
+
+    Args:
+        session: the database session
+        category_id: the category, or None for the whole catalog
+
+    Returns:
+        The number of items
+    """
+    if category_id is None:
+        return session.query(func.sum(Category.item_count)).scalar() or 0
+    return session.query(Category.item_count) \
+        .filter(Category.id == category_id).scalar() or 0
+
+
+def recountItems(bind):
+    """ Recomputes every stored item count from the item table
+
+    Loaders that insert items without the write routes call this when
+    they are done.
+
+    Args:
+        bind: an engine or connection
+    """
+    table = Category.__table__
+    count = select([func.count(Item.__table__.c.id)]) \
+        .where(Item.__table__.c.category_id == table.c.id).as_scalar()
+    bind.execute(table.update().values(item_count=count))
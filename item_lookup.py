@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+from sqlalchemy.orm import joinedload
+from database_setup import Item
+
+
+def requestedIds(args, largest):
+    """ Reads the item ids of a multi-get from the query string
+
+    The ids may be given comma separated, as repeated arguments or both:
+    ids=1,2,3 or ids=1&ids=2&ids=3.
+
+    Args:
+        args: the request's query arguments
+        largest: the most ids one request may ask for
+
+    Returns:
+        A list of integer item ids in the order they were asked for
+
+    Raises:
+        ValueError: if an id is not an integer, or there are none or too many
+    """
+    try:
+        ids = [int(value) for values in args.getlist('ids')
+               for value in values.split(',') if value.strip()]
+    except ValueError:
+        raise ValueError('ids must be a comma separated list of item ids')
+    if not ids:
+        raise ValueError('ids must list at least one item id')
+    if len(ids) > largest:
+        raise ValueError('at most %d ids can be requested at once' % largest)
+    return ids
+
+
+def serializeWithOwner(item):
+    """ Serializes an item together with its category name and owner
+
+    Args:
+        item: an Item whose category and user are loaded
+
+    Returns:
+        The item's serialize dict with category_name and owner added
+    """
+    owner = item.user
+    return dict(item.serialize,
+                category_name=item.category.name if item.category else None,
+                owner={'user_id': owner.id, 'name': owner.name}
+                if owner else None)
+
+
+def lookupItems(session, item_ids):
+    """ Loads many items with their categories and owners in one query
+
+    Args:
+        session: the database session to query with
+        item_ids: a list of integer item ids, which may repeat
+
+    Returns:
+        A list with one entry per requested id in the same order: the
+        serialized item, or {'item_id': id, 'error': 'not_found'}
+    """
+    items = session.query(Item) \
+        .options(joinedload(Item.category), joinedload(Item.user)) \
+        .filter(Item.id.in_(set(item_ids))).all()
+    found = dict((item.id, serializeWithOwner(item)) for item in items)
+    return [found.get(item_id) or {'item_id': item_id, 'error': 'not_found'}
+            for item_id in item_ids]
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+import logging
+import threading
+import time
+from flask import g, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_query_log = logging.getLogger('catalog.sql.slow')
+
+
+class Histogram(object):
+    """ Cumulative bucket counts plus a sum, as Prometheus expects """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics(object):
+    """ Per-endpoint request and SQL metrics for one process
+
+    Flask request hooks time every request and SQLAlchemy engine events
+    count and time the statements it runs. Statements slower than
+    slow_query_seconds are logged with their parameters.
+    """
+
+    def __init__(self, slow_query_seconds=0.1, query_count_header=False):
+        self.slow_query_seconds = slow_query_seconds
+        self.query_count_header = query_count_header
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.requests = {}
+        self.latency = {}
+        self.queries = {}
+        self.sql_seconds = {}
+        self.slow_queries = 0
+        self.gauges = []
+
+    def init_app(self, app, *engines):
+        """ Installs the request hooks and engine listeners
+
+        Args:
+            app: the Flask application
+            engines: the engines whose statements are measured
+        """
+        app.before_request(self.requestStarted)
+        app.after_request(self.requestFinished)
+        app.teardown_request(self.requestDone)
+        for engine in set(engines):
+            event.listen(engine, 'before_cursor_execute', self.queryStarted)
+            event.listen(engine, 'after_cursor_execute', self.queryFinished)
+
+    def gauge(self, name, description, read, kind='gauge'):
+        """ Exports a value read from elsewhere in the application
+
+        Args:
+            name: the metric name
+            description: the help text of the metric
+            read: a function returning a dict of label tuples to values,
+            where a label tuple is a tuple of (name, value) pairs
+            kind: the Prometheus metric type, gauge or counter
+        """
+        self.gauges.append((name, description, read, kind))
+
+    def requestStarted(self):
+        self.local.queries = 0
+        self.local.sql_seconds = 0
+        g.metrics_started = time.time()
+
+    def requestFinished(self, response):
+        g.metrics_status = response.status_code
+        if self.query_count_header:
+            response.headers['X-Query-Count'] = str(
+                getattr(self.local, 'queries', 0))
+        return response
+
+    def requestDone(self, exception=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.time() - started
+        status = g.pop('metrics_status', 500 if exception else 200)
+        endpoint = request.endpoint or 'unmatched'
+        queries = getattr(self.local, 'queries', 0)
+        sql_seconds = getattr(self.local, 'sql_seconds', 0)
+        self.local.queries = self.local.sql_seconds = None
+        with self.lock:
+            key = (endpoint, request.method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(
+                endpoint, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self.queries.setdefault(
+                endpoint, Histogram(QUERY_BUCKETS)).observe(queries)
+            self.sql_seconds[endpoint] = \
+                self.sql_seconds.get(endpoint, 0) + sql_seconds
+
+    def queryStarted(self, conn, cursor, statement, parameters, context,
+                     executemany):
+        conn.info.setdefault('metrics_started', []).append(time.time())
+
+    def queryFinished(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        elapsed = time.time() - conn.info['metrics_started'].pop()
+        if getattr(self.local, 'queries', None) is not None:
+            self.local.queries += 1
+            self.local.sql_seconds += elapsed
+        if elapsed >= self.slow_query_seconds:
+            with self.lock:
+                self.slow_queries += 1
+            slow_query_log.warning('%.1fms %s %r', elapsed * 1000,
+                                   statement, parameters)
+
+    def render(self):
+        """ Formats every metric in the Prometheus text exposition format
+
+        Returns:
+            The metrics as a string
+        """
+        lines = []
+        with self.lock:
+            lines.append('# HELP catalog_requests_total Requests handled.')
+            lines.append('# TYPE catalog_requests_total counter')
+            for (endpoint, method, status), count in \
+                    sorted(self.requests.items()):
+                lines.append(sample('catalog_requests_total',
+                                    (('endpoint', endpoint),
+                                     ('method', method),
+                                     ('status', status)), count))
+            histograms(lines, 'catalog_request_duration_seconds',
+                       'Request latency in seconds.', self.latency)
+            histograms(lines, 'catalog_request_queries',
+                       'SQL statements run per request.', self.queries)
+            lines.append('# HELP catalog_sql_seconds_total Time spent in SQL '
+                         'statements.')
+            lines.append('# TYPE catalog_sql_seconds_total counter')
+            for endpoint, seconds in sorted(self.sql_seconds.items()):
+                lines.append(sample('catalog_sql_seconds_total',
+                                    (('endpoint', endpoint),), seconds))
+            lines.append('# HELP catalog_slow_queries_total SQL statements '
+                         'slower than %gs.' % self.slow_query_seconds)
+            lines.append('# TYPE catalog_slow_queries_total counter')
+            lines.append(sample('catalog_slow_queries_total', (),
+                                self.slow_queries))
+        for name, description, read, kind in self.gauges:
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in sorted(read().items()):
+                lines.append(sample(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+def sample(name, labels, value):
+    """ Formats one Prometheus sample line """
+    if labels:
+        name += '{%s}' % ','.join(
+            '%s="%s"' % (key, str(label).replace('\\', '\\\\')
+                         .replace('"', '\\"'))
+            for key, label in labels)
+    return '%s %s' % (name, repr(float(value)) if isinstance(value, float)
+                      else value)
+
+
+def histograms(lines, name, description, by_endpoint):
+    lines.append('# HELP %s %s' % (name, description))
+    lines.append('# TYPE %s histogram' % name)
+    for endpoint, histogram in sorted(by_endpoint.items()):
+        labels = (('endpoint', endpoint),)
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(sample(name + '_bucket',
+                                labels + (('le', bound),), count))
+        lines.append(sample(name + '_bucket', labels + (('le', '+Inf'),),
+                            histogram.count))
+        lines.append(sample(name + '_sum', labels, float(histogram.sum)))
+        lines.append(sample(name + '_count', labels, histogram.count))
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+import sys
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+from database_setup import Base
+from db import databaseURL
+from item_counts import recountItems
+from search import ensureSearchIndex
+
+# The lookups that run on every category page view and every login
+HOT_QUERIES = [
+    ('displayCategoryItems: category by name',
+     'SELECT id FROM category WHERE name = :value', 'Soccer'),
+    ('displayCategoryItems: page of items in category',
+     'SELECT id, name FROM item WHERE category_id = :value AND id > 0 '
+     'ORDER BY id LIMIT 51', 1),
+    ('getUserID: user by email',
+     'SELECT id FROM "user" WHERE email = :value', 'user@example.com'),
+]
+
+
+def queryPlan(engine, sql, value):
+    """ Asks the database how it would run a query
+
+    Args:
+        engine: the engine connected to the database
+        sql: the query text with a single :value parameter
+        value: the value to bind to the parameter
+
+    Returns:
+        A list of query plan lines
+    """
+    if engine.dialect.name == 'sqlite':
+        rows = engine.execute(text('EXPLAIN QUERY PLAN ' + sql), value=value)
+        return [row[-1] for row in rows]
+    rows = engine.execute(text('EXPLAIN ' + sql), value=value)
+    return [row[0] for row in rows]
+
+
+def printQueryPlans(engine):
+    """ Prints the query plan of every hot lookup """
+    for label, sql, value in HOT_QUERIES:
+        print label
+        for line in queryPlan(engine, sql, value):
+            print '    %s' % line
+
+
+def missingIndexes(engine):
+    """ Finds the indexes declared in the models but not in the database
+
+    Args:
+        engine: the engine connected to the database
+
+    Returns:
+        A list of sqlalchemy Index objects
+    """
+    inspector = inspect(engine)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        existing = set(index['name'] for index in
+                       inspector.get_indexes(table.name))
+        missing.extend(index for index in table.indexes
+                       if index.name not in existing)
+    return missing
+
+
+def missingColumns(engine):
+    """ Finds the columns declared in the models but not in the database
+
+    Args:
+        engine: the engine connected to the database
+
+    Returns:
+        A list of sqlalchemy Column objects
+    """
+    inspector = inspect(engine)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        existing = set(column['name'] for column in
+                       inspector.get_columns(table.name))
+        missing.extend(column for column in table.columns
+                       if column.name not in existing)
+    return missing
+
+
+def addColumn(engine, column):
+    """ Adds a column with a server default to an existing table """
+    preparer = engine.dialect.identifier_preparer
+    sql = 'ALTER TABLE %s ADD COLUMN %s %s' % (
+        preparer.format_table(column.table), preparer.format_column(column),
+        column.type.compile(engine.dialect))
+    if column.server_default is not None:
+        sql += " DEFAULT '%s'" % column.server_default.arg
+    if not column.nullable:
+        sql += ' NOT NULL'
+    engine.execute(sql)
+
+
+def upgrade(engine):
+    """ Brings an existing database up to date with the models
+
+    Missing tables are created and missing columns and indexes, including
+    the full-text search index, are added in place, so existing data is
+    kept. The stored item counts are filled in when they are added.
+
+    Args:
+        engine: the engine connected to the database
+
+    Returns:
+        A list of the names of the columns and indexes that were created
+    """
+    Base.metadata.create_all(engine)
+    created = []
+    for column in missingColumns(engine):
+        addColumn(engine, column)
+        created.append('%s.%s' % (column.table.name, column.name))
+        if column is Base.metadata.tables['category'].c.item_count:
+            recountItems(engine)
+    for index in missingIndexes(engine):
+        try:
+            index.create(engine)
+        except IntegrityError:
+            columns = ', '.join(column.name for column in index.columns)
+            raise SystemExit('Cannot create unique index %s: %s has '
+                             'duplicate values in %s'
+                             % (index.name, index.table.name, columns))
+        created.append(index.name)
+    ensureSearchIndex(engine)
+    return created
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    check_only = '--check' in args
+    args = [arg for arg in args if arg != '--check']
+    engine = create_engine(args[0] if args else databaseURL())
+    print 'Query plans before migration:'
+    printQueryPlans(engine)
+    if check_only:
+        sys.exit(0)
+    for name in upgrade(engine):
+        print 'created %s' % name
+    print 'Query plans after migration:'
+    printQueryPlans(engine)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatch
+from functools import wraps
+from flask import request, make_response
+from flask import session as login_session
+
+
+class LRUBackend(object):
+    """ A bounded in-process store that drops the least recently used page
+
+    Entries also expire after ttl seconds, like those kept in Redis.
+    """
+
+    def __init__(self, size=1024, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self.entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time() + self.ttl)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisBackend(object):
+    """ Stores pages in Redis so every worker process shares them
+
+    Entries expire after ttl seconds as a safety net. Redis errors are
+    treated as cache misses so an outage only costs performance.
+    """
+
+    def __init__(self, client, ttl=300, prefix='catalog:page:'):
+        import redis
+        self.error = redis.RedisError
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def key(self, key):
+        return (self.prefix + key).encode('utf-8')
+
+    def get(self, key):
+        try:
+            return self.client.get(self.key(key))
+        except self.error:
+            return None
+
+    def set(self, key, value):
+        try:
+            self.client.setex(self.key(key), self.ttl, value)
+        except self.error:
+            pass
+
+    def delete(self, *keys):
+        try:
+            self.client.delete(*[self.key(key) for key in keys])
+        except self.error:
+            pass
+
+    def clear(self):
+        try:
+            keys = list(self.client.scan_iter(self.prefix + '*'))
+            if keys:
+                self.client.delete(*keys)
+        except self.error:
+            pass
+
+
+class FakeRedis(object):
+    """ The subset of the redis client used by RedisBackend, kept in memory """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def setex(self, key, ttl, value):
+        self.data[key] = (value, time.time() + ttl)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in self.data if fnmatch(key, match)]
+
+
+def createBackend(name, size=1024, ttl=300, redis_url=None):
+    """ Creates the page cache backend selected in the configuration
+
+    Args:
+        name: 'memory', 'redis' or 'none'
+        size: the number of pages kept by the memory backend
+        ttl: the lifetime of a cached page in seconds
+        redis_url: the Redis server to connect to
+
+    Returns:
+        A backend, or None when the cache is disabled
+    """
+    if name == 'memory':
+        return LRUBackend(size, ttl)
+    if name == 'redis':
+        import redis
+        return RedisBackend(redis.StrictRedis.from_url(redis_url), ttl)
+    if name in ('none', ''):
+        return None
+    raise ValueError('Unknown page cache backend %r' % name)
+
+
+class PageCache(object):
+    """ Caches rendered pages for visitors who are not logged in
+
+    Logged in users see their own buttons in the header and pending flash
+    messages are rendered once, so those responses always bypass the cache.
+
+    A page can be rendered from data read before a write whose eviction
+    runs while it renders. The version of the page's scope is therefore
+    taken before rendering, and a page whose version moved on by the time
+    it was stored is removed again.
+    """
+
+    def __init__(self, backend=None, versions=None):
+        self.backend = backend
+        self.versions = versions
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, key, scope=None):
+        """ Decorates a view so anonymous responses are served from the cache
+
+        Args:
+            key: a function that maps the view arguments to a cache key
+            scope: None for a page of the whole catalog, or a function that
+            maps the view arguments to a scope of the CatalogVersion
+
+        Returns:
+            The decorator
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                if (self.backend is None or request.method != 'GET' or
+                        'username' in login_session or
+                        '_flashes' in login_session):
+                    return view(**kwargs)
+                try:
+                    page_key = key(**kwargs)
+                except ValueError:
+                    return view(**kwargs)
+                body = self.backend.get(page_key)
+                if body is not None:
+                    self.count(hit=True)
+                    response = make_response(body)
+                    response.headers['X-Page-Cache'] = 'HIT'
+                    return response
+                self.count(hit=False)
+                stamp = self.stamp(scope, kwargs)
+                response = make_response(view(**kwargs))
+                if response.status_code == 200:
+                    self.backend.set(page_key, response.get_data())
+                    if self.stamp(scope, kwargs) != stamp:
+                        self.backend.delete(page_key)
+                response.headers['X-Page-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    def stamp(self, scope, kwargs):
+        if self.versions is None:
+            return None
+        return self.versions.stamp(scope(**kwargs) if scope else None)
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def evict(self, *keys):
+        """ Removes pages from the cache after the data behind them changed """
+        if self.backend is not None and keys:
+            self.backend.delete(*keys)
+
+    def clear(self):
+        """ Removes every page, when it is not known what changed """
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        """ Gets the hit and miss counters of this process """
+        with self.lock:
+            return {'backend': type(self.backend).__name__,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+def firstPageKey(key):
+    """ Limits a cache key function to requests without query arguments
+
+    Later pages of a paged view are not cached, so the writes that evict
+    the page only have one key to remove.
+
+    Args:
+        key: a function that maps the view arguments to a cache key
+
+    Returns:
+        A key function that raises ValueError for other pages
+    """
+    @wraps(key)
+    def pageKey(**kwargs):
+        if request.args:
+            raise ValueError('only the first page is cached')
+        return key(**kwargs)
+    return pageKey
+
+
+def catalogKey(**kwargs):
+    return 'catalog'
+
+
+def categoryKey(category_name, **kwargs):
+    return 'category:%s' % category_name
+
+
+def itemKey(item_id, **kwargs):
+    return 'item:%d' % int(item_id)
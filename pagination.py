@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+# items is one page of rows. before and after are the cursors of the
+# previous and next pages, None when there is no such page.
+Page = namedtuple('Page', ['items', 'before', 'after'])
+
+
+def pageCursor(args):
+    """ Reads the cursor of a paged request
+
+    Args:
+        args: the request's query arguments
+
+    Returns:
+        An (after, before) tuple of item ids, either may be None. Raises
+        ValueError when a cursor is not an integer.
+    """
+    after = args.get('after')
+    before = args.get('before')
+    return (int(after) if after is not None else None,
+            int(before) if before is not None else None)
+
+
+def pageSize(args, default, largest):
+    """ Reads the page size of a paged request, clamped to 1..largest """
+    try:
+        size = int(args.get('limit', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, largest))
+
+
+def keysetPage(query, column, size, after=None, before=None):
+    """ Loads one page of a query ordered by a unique integer column
+
+    Pages are found with the column's index instead of an OFFSET, so every
+    page costs the same no matter how deep it is.
+
+    Args:
+        query: the query to page through
+        column: the unique column to order by, such as Item.id
+        size: the number of rows per page
+        after: return the rows after this value
+        before: return the rows before this value, if after is None
+
+    Returns:
+        A Page
+    """
+    if before is not None and after is None:
+        rows = query.filter(column < before).order_by(column.desc()) \
+            .limit(size + 1).all()
+        has_previous = len(rows) > size
+        rows = rows[:size][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            query = query.filter(column > after)
+        rows = query.order_by(column).limit(size + 1).all()
+        has_next = len(rows) > size
+        rows = rows[:size]
+        has_previous = after is not None
+    key = column.key
+    first = getattr(rows[0], key) if rows else (
+        after + 1 if after is not None else None)
+    last = getattr(rows[-1], key) if rows else (
+        before - 1 if before is not None else None)
+    return Page(rows, first if has_previous else None,
+                last if has_next else None)
+
+
+def sortedPage(ids, size, after=None, before=None):
+    """ Finds one page of a sorted sequence of ids held in memory
+
+    The pages and cursors are the same as keysetPage's for the same ids.
+
+    Args:
+        ids: a sorted sequence of unique integers
+        size: the number of ids per page
+        after: return the ids after this value
+        before: return the ids before this value, if after is None
+
+    Returns:
+        A Page whose items are ids
+    """
+    if before is not None and after is None:
+        end = bisect_left(ids, before)
+        start = max(end - size, 0)
+        rows = ids[start:end]
+        has_previous = start > 0
+        has_next = True
+    else:
+        start = bisect_right(ids, after) if after is not None else 0
+        rows = ids[start:start + size]
+        has_next = start + size < len(ids)
+        has_previous = after is not None
+    first = rows[0] if rows else (after + 1 if after is not None else None)
+    last = rows[-1] if rows else (before - 1 if before is not None else None)
+    return Page(list(rows), first if has_previous else None,
+                last if has_next else None)
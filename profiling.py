@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# Profiles sampled requests and reports on the saved profiles.
+#
+# Usage, from the repository root:
+#   python profiling.py [--dir DIR] [--endpoint NAME] [--top N]
+#       [--sort cumulative|tottime|calls]
+import argparse
+import cProfile
+import glob
+import hmac
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from flask import request
+
+HEADER = 'HTTP_X_PROFILE'
+UNSAFE = re.compile(r'[^A-Za-z0-9_.]')
+
+
+class RequestProfiler(object):
+    """ Runs cProfile over a sample of requests and saves the profiles
+
+    A request is profiled when it is picked by sample_rate, or when it
+    carries an X-Profile header equal to token. The whole request is
+    covered: the view, the ORM, template rendering, the after request
+    hooks and the streaming of the body. Each profile is saved in
+    directory as <timestamp>-<endpoint>-<pid>.prof and only the newest
+    max_files are kept. Requests profiled because of the header get the
+    file name back in an X-Profile-Dump header.
+
+    When neither a sample rate nor a token is set, the application is not
+    wrapped at all, so the profiler costs nothing.
+    """
+
+    def __init__(self, directory='profiles', sample_rate=0.0, token=None,
+                 max_files=200):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        self.app = None
+
+    def init_app(self, app):
+        """ Wraps the application's WSGI callable if profiling is on
+
+        Args:
+            app: the Flask application
+        """
+        if self.sample_rate <= 0 and not self.token:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        app.before_request(self.labelRequest)
+        app.after_request(self.addDumpHeader)
+        self.app = app.wsgi_app
+        app.wsgi_app = self
+
+    def wanted(self, environ):
+        """ Decides whether to profile a request
+
+        Returns:
+            'header' if the request asked for it with the token, 'sample'
+            if it was sampled, or None
+        """
+        if self.token and HEADER in environ and \
+                hmac.compare_digest(str(environ[HEADER]), str(self.token)):
+            return 'header'
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return 'sample'
+        return None
+
+    def labelRequest(self):
+        if 'catalog.profile' in request.environ:
+            request.environ['catalog.profile.endpoint'] = \
+                request.endpoint or 'unmatched'
+
+    def addDumpHeader(self, response):
+        if request.environ.get('catalog.profile') == 'header':
+            request.environ['catalog.profile.name'] = self.fileName(
+                request.endpoint or 'unmatched')
+            response.headers['X-Profile-Dump'] = \
+                request.environ['catalog.profile.name']
+        return response
+
+    def __call__(self, environ, start_response):
+        reason = self.wanted(environ)
+        if reason is None:
+            return self.app(environ, start_response)
+        environ['catalog.profile'] = reason
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            body = self.app(environ, start_response)
+        except Exception:
+            profile.disable()
+            self.save(profile, environ)
+            raise
+        return ProfiledBody(body, profile, lambda: self.save(profile, environ))
+
+    def fileName(self, endpoint):
+        now = time.time()
+        return '%s.%06d-%s-%d.prof' % (
+            time.strftime('%Y%m%dT%H%M%S', time.gmtime(now)),
+            int(now % 1 * 1000000), UNSAFE.sub('_', endpoint), os.getpid())
+
+    def save(self, profile, environ):
+        """ Writes a profile and drops the oldest ones over max_files """
+        name = environ.get('catalog.profile.name') or self.fileName(
+            environ.get('catalog.profile.endpoint', 'unmatched'))
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path + '.tmp')
+        os.rename(path + '.tmp', path)
+        with self.lock:
+            dumps = sorted(glob.glob(os.path.join(self.directory, '*.prof')))
+            for old in dumps[:max(len(dumps) - self.max_files, 0)]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+
+class ProfiledBody(object):
+    """ Keeps profiling while the server sends the body, then saves it """
+
+    def __init__(self, body, profile, done):
+        self.body = body
+        self.profile = profile
+        self.done = done
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.profile.disable()
+            self.done()
+
+
+def endpointOf(path):
+    """ Reads the endpoint from the name of a saved profile """
+    return os.path.basename(path).split('-')[1]
+
+
+def aggregate(directory, endpoint=None):
+    """ Adds up the saved profiles of each endpoint
+
+    Args:
+        directory: the directory the profiles were saved in
+        endpoint: only read the profiles of this endpoint
+
+    Returns:
+        A dict of endpoint names to (number of profiles, pstats.Stats)
+    """
+    stats = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.prof'))):
+        name = endpointOf(path)
+        if endpoint is not None and name != endpoint:
+            continue
+        if name in stats:
+            count, combined = stats[name]
+            combined.add(path)
+            stats[name] = (count + 1, combined)
+        else:
+            stats[name] = (1, pstats.Stats(path, stream=sys.stdout))
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report the saved request profiles by endpoint')
+    parser.add_argument('--dir', default=os.environ.get('PROFILE_DIR',
+                                                        'profiles'),
+                        help='the profile directory, defaults to PROFILE_DIR')
+    parser.add_argument('--endpoint', help='only report this endpoint')
+    parser.add_argument('--top', type=int, default=20,
+                        help='functions listed per endpoint')
+    parser.add_argument('--sort', default='cumulative',
+                        choices=['cumulative', 'tottime', 'calls'])
+    args = parser.parse_args()
+
+    stats = aggregate(args.dir, args.endpoint)
+    if not stats:
+        sys.exit('no profiles in %s' % args.dir)
+    for name, (count, combined) in sorted(stats.items()):
+        print '=' * 78
+        print '%s: %d requests, %.3fs in total, %.1fms per request' % (
+            name, count, combined.total_tt,
+            combined.total_tt * 1000 / count)
+        combined.strip_dirs().sort_stats(args.sort).print_stats(args.top)
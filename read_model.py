@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+import logging
+import time
+from array import array
+from bisect import bisect_left, insort
+from catalog_export import serializeCategory
+from category_cache import CategoryEntry, CategoryIndex
+from database_setup import Category, Item
+from pagination import sortedPage
+
+log = logging.getLogger('catalog.read_model')
+
+
+class ItemRecord(object):
+    """ The columns of one item that the read routes need """
+    __slots__ = ('id', 'name', 'description', 'category_id', 'user_id')
+
+    def __init__(self, id, name, description, category_id, user_id):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.category_id = category_id
+        self.user_id = user_id
+
+    @classmethod
+    def fromChange(cls, change):
+        return cls(change.item_id, change.name, change.description,
+                   change.category_id, change.user_id)
+
+    @property
+    def serialize(self):
+        """ The same dict as Item.serialize """
+        return {
+            'item_id': self.id,
+            'item_name': self.name,
+            'item_description': self.description,
+            'category_id': self.category_id
+        }
+
+
+def updatedIds(ids, added=(), removed=()):
+    """ Copies a sorted id array with some ids added and others removed
+
+    Args:
+        ids: a sorted array of unique ids
+        added: ids to add, which are not in ids
+        removed: ids to remove
+
+    Returns:
+        A new sorted array; ids itself is not changed
+    """
+    positions = []
+    for item_id in removed:
+        position = bisect_left(ids, item_id)
+        if position < len(ids) and ids[position] == item_id:
+            positions.append(position)
+    result = array('l')
+    start = 0
+    for position in sorted(positions):
+        result.extend(ids[start:position])
+        start = position + 1
+    result.extend(ids[start:])
+    for item_id in sorted(added):
+        if not result or item_id > result[-1]:
+            result.append(item_id)
+        else:
+            insort(result, item_id)
+    return result
+
+
+class CatalogModel(object):
+    """ Every category and item of the catalog, indexed for the read routes
+
+    Attributes:
+        items: a dict of item id to ItemRecord
+        by_category: a dict of category id to a sorted array of item ids
+        ordered: a sorted array of every item id, newest last
+        categories: a CategoryIndex
+        loaded: when the model was loaded from scratch
+    """
+    __slots__ = ('items', 'by_category', 'ordered', 'categories', 'loaded')
+
+    def __init__(self, items, categories):
+        self.items = {}
+        ordered = array('l')
+        grouped = {}
+        for record in items:
+            self.items[record.id] = record
+            ordered.append(record.id)
+            grouped.setdefault(record.category_id, array('l')).append(
+                record.id)
+        self.ordered = ordered
+        self.by_category = grouped
+        self.categories = categories
+        self.loaded = time.time()
+
+    def apply(self, records, removed):
+        """ Applies item writes; arrays are replaced rather than changed
+
+        Args:
+            records: ItemRecords that were created or edited
+            removed: ids of items that were deleted
+        """
+        added = {}
+        dropped = {}
+        new_ids = []
+        for item_id in removed:
+            old = self.items.get(item_id)
+            if old is not None:
+                dropped.setdefault(old.category_id, set()).add(item_id)
+        for record in records:
+            old = self.items.get(record.id)
+            if old is None:
+                new_ids.append(record.id)
+            elif old.category_id != record.category_id:
+                dropped.setdefault(old.category_id, set()).add(record.id)
+            else:
+                continue
+            added.setdefault(record.category_id, set()).add(record.id)
+        for category_id in set(added) | set(dropped):
+            self.by_category[category_id] = updatedIds(
+                self.by_category.get(category_id, array('l')),
+                added.get(category_id, ()), dropped.get(category_id, ()))
+        if new_ids or removed:
+            self.ordered = updatedIds(
+                self.ordered, new_ids,
+                [item_id for item_id in removed if item_id in self.items])
+        for record in records:
+            self.items[record.id] = record
+        for item_id in removed:
+            self.items.pop(item_id, None)
+
+    def item(self, item_id):
+        """ Gets an ItemRecord by id, or None if there is no such item """
+        try:
+            return self.items.get(int(item_id))
+        except ValueError:
+            return None
+
+    def categoryPage(self, category_id, size, after=None, before=None):
+        """ Gets one page of a category's items, as keysetPage would
+
+        Returns:
+            A Page of ItemRecords
+        """
+        page = sortedPage(self.by_category.get(category_id, ()), size,
+                          after, before)
+        items = self.items
+        return page._replace(items=[items[item_id] for item_id in page.items
+                                    if item_id in items])
+
+    def itemCount(self, category_id):
+        return len(self.by_category.get(category_id, ()))
+
+    def latestItems(self, count):
+        """ Gets the newest items for the front page
+
+        Returns:
+            A list of serialized items including their category_name
+        """
+        names = self.categories.names
+        latest = []
+        for item_id in reversed(self.ordered[-count:] if count else []):
+            record = self.items.get(item_id)
+            if record is not None:
+                category_name = names.get(record.category_id)
+                latest.append(dict(record.serialize,
+                                   category_name=category_name))
+        return latest
+
+    def iterCatalogJSON(self):
+        """ Yields the /catalog.json document, as iterCatalogJSON does """
+        yield '{"category":['
+        separator = ''
+        items = self.items
+        for category in sorted(self.categories.categories,
+                               key=lambda category: category.id):
+            records = [items[item_id].serialize for item_id in
+                       self.by_category.get(category.id, ())
+                       if item_id in items]
+            yield separator + serializeCategory(category.id, category.name,
+                                                records)
+            separator = ','
+        yield ']}\n'
+
+
+class ReadModel(object):
+    """ Keeps the whole catalog in memory so reads need no SQL
+
+    The model is kept up to date with the change log, which hands it the
+    writes of every process, this one's included, in the order they were
+    committed. It is loaded again from scratch every reload_seconds, or
+    when the log was pruned past what it has seen.
+    """
+
+    def __init__(self, reload_seconds=3600):
+        self.reload_seconds = reload_seconds
+        self.enabled = False
+        self.model = None
+
+    def init_app(self, app, session):
+        """ Loads the model and turns it on
+
+        Args:
+            app: the Flask application
+            session: the scoped session to load the catalog with
+        """
+        self.enabled = True
+        try:
+            self.model = self.load(session)
+        finally:
+            session.remove()
+
+    def load(self, session):
+        """ Reads every category and item into a new CatalogModel """
+        started = time.time()
+        rows = session.query(Item.id, Item.name, Item.description,
+                             Item.category_id, Item.user_id) \
+            .order_by(Item.id).yield_per(5000)
+        model = CatalogModel((ItemRecord(*row) for row in rows),
+                             self.loadCategories(session))
+        log.info('loaded %d items in %.2fs', len(model.items),
+                 time.time() - started)
+        return model
+
+    def loadCategories(self, session):
+        return CategoryIndex(
+            CategoryEntry(*row) for row in session.query(
+                Category.id, Category.name).order_by(Category.name))
+
+    def current(self):
+        """ Gets the model, as of the last change applied """
+        return self.model
+
+    def expired(self):
+        """ Tells whether the model is due to be loaded from scratch """
+        return time.time() - self.model.loaded >= self.reload_seconds
+
+    def reload(self, session):
+        """ Loads the model again from scratch """
+        self.model = self.load(session)
+
+    def apply(self, session, changes):
+        """ Applies item writes read from the change log
+
+        Args:
+            session: the scoped session to reload the categories with
+            changes: a list of CatalogChange rows in id order
+        """
+        latest = {}
+        for change in changes:
+            latest[change.item_id] = None if change.action == 'delete' \
+                else ItemRecord.fromChange(change)
+        model = self.model
+        model.categories = self.loadCategories(session)
+        model.apply([record for record in latest.values() if record],
+                    [item_id for item_id, record in latest.items()
+                     if record is None])
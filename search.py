@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+import logging
+import re
+from sqlalchemy import and_, bindparam, case, or_, select, text
+from sqlalchemy.exc import OperationalError
+from database_setup import Item
+
+# SQLite keeps an external-content FTS5 table in sync with item by triggers
+SQLITE_SCHEMA = [
+    """CREATE VIRTUAL TABLE item_fts USING fts5(
+        name, description, content='item', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 1', prefix='2 3')""",
+    """CREATE TRIGGER item_fts_insert AFTER INSERT ON item BEGIN
+        INSERT INTO item_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER item_fts_delete AFTER DELETE ON item BEGIN
+        INSERT INTO item_fts(item_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER item_fts_update AFTER UPDATE ON item BEGIN
+        INSERT INTO item_fts(item_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO item_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+    "INSERT INTO item_fts(item_fts) VALUES ('rebuild')",
+]
+
+# PostgreSQL maintains an expression index on its own, no triggers needed
+POSTGRES_DOCUMENT = ("to_tsvector('english', coalesce(item.name, '') || ' ' "
+                     "|| coalesce(item.description, ''))")
+POSTGRES_SCHEMA = [
+    "CREATE INDEX IF NOT EXISTS ix_item_search ON item USING gin (%s)"
+    % POSTGRES_DOCUMENT,
+]
+
+# Matches in the name weigh more than matches in the description
+SQLITE_SEARCH = text("""
+    SELECT item.id, item.name, item.description, item.category_id
+    FROM item_fts JOIN item ON item.id = item_fts.rowid
+    WHERE item_fts MATCH :query
+    ORDER BY bm25(item_fts, 10.0, 1.0), item.id
+    LIMIT :limit OFFSET :offset""")
+POSTGRES_SEARCH = text("""
+    SELECT item.id, item.name, item.description, item.category_id
+    FROM item, to_tsquery('english', :query) query
+    WHERE %s @@ query
+    ORDER BY ts_rank(%s, query) DESC, item.id
+    LIMIT :limit OFFSET :offset""" % (POSTGRES_DOCUMENT, POSTGRES_DOCUMENT))
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+log = logging.getLogger('catalog.search')
+
+
+def ensureSearchIndex(engine):
+    """ Creates the full-text index on the item table if it is missing
+
+    SQLite builds without FTS5 and other databases get no index, and
+    their searches fall back to scanning the item table with LIKE.
+
+    Args:
+        engine: the engine connected to the catalog database
+
+    Returns:
+        True if searches can use the full-text index
+    """
+    if engine.dialect.name == 'sqlite':
+        exists = engine.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'item_fts'").scalar()
+        if exists:
+            return True
+        try:
+            with engine.begin() as connection:
+                for statement in SQLITE_SCHEMA:
+                    connection.execute(statement)
+        except OperationalError as error:
+            log.warning('full-text search is unavailable, searching with '
+                        'LIKE instead: %s', error.orig)
+            return False
+        return True
+    elif engine.dialect.name == 'postgresql':
+        with engine.begin() as connection:
+            for statement in POSTGRES_SCHEMA:
+                connection.execute(statement)
+        return True
+    log.warning('full-text search is not supported on %s, searching with '
+                'LIKE instead', engine.dialect.name)
+    return False
+
+
+def matchQuery(terms, dialect):
+    """ Turns the words typed by a user into a prefix-matching query
+
+    Every word has to match, and the last one may be incomplete. Anything
+    that is not a word character is dropped, so user input can never
+    inject query syntax.
+
+    Args:
+        terms: the search text
+        dialect: the name of the database dialect
+
+    Returns:
+        The query string, or None if the text has no words
+    """
+    words = WORD.findall(terms or '')
+    if not words:
+        return None
+    if dialect == 'postgresql':
+        return ' & '.join('%s:*' % word for word in words)
+    return ' '.join('"%s"*' % word for word in words)
+
+
+def likeSearch(words):
+    """ Builds a search that scans the item table for every word
+
+    Each word may appear anywhere in the name or the description. Items
+    whose name holds every word come first.
+
+    Args:
+        words: the words typed by the user
+
+    Returns:
+        A select of (id, name, description, category_id) with limit and
+        offset bind parameters
+    """
+    item = Item.__table__
+    patterns = ['%%%s%%' % word.replace('_', '\\_') for word in words]
+    in_name = and_(*[item.c.name.ilike(pattern, escape='\\')
+                     for pattern in patterns])
+    return select([item.c.id, item.c.name, item.c.description,
+                   item.c.category_id]) \
+        .where(and_(*[or_(item.c.name.ilike(pattern, escape='\\'),
+                          item.c.description.ilike(pattern, escape='\\'))
+                      for pattern in patterns])) \
+        .order_by(case([(in_name, 0)], else_=1), item.c.id) \
+        .limit(bindparam('limit')).offset(bindparam('offset'))
+
+
+def searchItems(session, terms, page=1, per_page=20, full_text=True):
+    """ Finds the items that best match the search text
+
+    Args:
+        session: the database session to query with
+        terms: the search text
+        page: the 1-based page number
+        per_page: the number of results on a page
+        full_text: False to scan the item table with LIKE, for databases
+        without a full-text index
+
+    Returns:
+        A (rows, has_next) tuple where rows is a list of
+        (id, name, description, category_id) tuples in rank order
+    """
+    dialect = session.get_bind().dialect.name
+    query = matchQuery(terms, dialect)
+    if query is None:
+        return [], False
+    if not full_text:
+        search = likeSearch(WORD.findall(terms))
+    elif dialect == 'postgresql':
+        search = POSTGRES_SEARCH
+    else:
+        search = SQLITE_SEARCH
+    params = {'query': query,
+              'limit': per_page + 1,
+              'offset': (page - 1) * per_page}
+    rows = session.execute(search, params).fetchall()
+    return [tuple(row) for row in rows[:per_page]], len(rows) > per_page
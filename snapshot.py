@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# Builds the catalog snapshot files served as /catalog.json.
+#
+# Usage, from the repository root:
+#   python snapshot.py --dir DIR [--database URL] [--no-msgpack] [--check]
+import argparse
+import fcntl
+import glob
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from flask import json, request, send_file
+from catalog_export import iterCatalogRows, serializeCategory
+from change_log import changedCategories, logPosition
+from compression import compressChunks, encodings, negotiate
+from database_setup import Category
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+log = logging.getLogger('catalog.snapshot')
+
+MIMETYPES = {'json': 'application/json', 'msgpack': 'application/msgpack'}
+
+
+class CatalogSnapshot(object):
+    """ The full catalog export, kept on disk and refreshed after writes
+
+    Every category is stored as its own segment file, once as the compact
+    JSON that /catalog.json sends and once as MessagePack if the msgpack
+    package is installed. The full snapshot is the concatenation of the
+    segments, so after item writes only the segments of the categories
+    they touched are rebuilt from the database. The manifest records the
+    change log position the snapshot is up to date with, and the
+    categories to rebuild are read from the log since then, so nothing is
+    lost when a refresh fails or a worker exits before it runs one. Each snapshot gets the next
+    version number and is written next to the previous one, gzip and
+    brotli copies included, before the manifest is switched over. Files
+    are sent with send_file, so the WSGI server can use sendfile and
+    clients can ask for byte ranges.
+
+    Refreshes run on a background thread a short delay after a write, so
+    a burst of writes is folded into one refresh, and a failed refresh is
+    tried again retry seconds later. Worker processes share the directory
+    and take turns through a lock file.
+    """
+
+    def __init__(self, directory=None, use_msgpack=True, delay=1.0,
+                 keep=2, retry=30):
+        self.directory = directory
+        self.use_msgpack = use_msgpack and msgpack is not None
+        self.delay = delay
+        self.keep = keep
+        self.retry = retry
+        self.session_factory = None
+        self.condition = threading.Condition()
+        self.pending = False
+        self.worker_pid = None
+        self.cached = (None, None)
+
+    def init_app(self, app, session_factory):
+        """ Prepares the directory and brings the snapshot up to date
+
+        The snapshot is refreshed before the application serves, so no
+        thread is running yet when a preforking server forks it.
+
+        Args:
+            app: the Flask application
+            session_factory: makes the sessions that refreshes read with
+        """
+        self.session_factory = session_factory
+        if not os.path.isdir(self.segmentDirectory()):
+            os.makedirs(self.segmentDirectory())
+        session = session_factory()
+        try:
+            self.refresh(session)
+        finally:
+            session.close()
+
+    def formats(self):
+        return ('json', 'msgpack') if self.use_msgpack else ('json',)
+
+    def segmentDirectory(self):
+        return os.path.join(self.directory, 'segments')
+
+    def segmentPath(self, category_id, extension):
+        return os.path.join(self.segmentDirectory(),
+                            '%d.%s' % (category_id, extension))
+
+    def manifest(self):
+        """ Reads the manifest of the current snapshot
+
+        Returns:
+            A dict with the version, the generated time, the change log
+            position and epoch and the file names of the snapshot, or None
+            if there is no snapshot yet
+        """
+        path = os.path.join(self.directory, 'manifest.json')
+        try:
+            status = os.stat(path)
+        except OSError:
+            return None
+        # A new manifest is moved into place, so it has a new inode
+        stamp = (status.st_ino, status.st_mtime)
+        cached_stamp, manifest = self.cached
+        if cached_stamp != stamp:
+            with open(path, 'rb') as manifest_file:
+                manifest = json.loads(manifest_file.read())
+            self.cached = (stamp, manifest)
+        return manifest
+
+    def markDirty(self):
+        """ Schedules a refresh after items were written """
+        with self.condition:
+            self.pending = True
+            # Threads do not survive a fork, so each worker starts its own
+            if self.worker_pid != os.getpid():
+                self.worker_pid = os.getpid()
+                worker = threading.Thread(target=self.work)
+                worker.daemon = True
+                worker.start()
+            self.condition.notify()
+
+    def catchUp(self, position, epoch):
+        """ Schedules a refresh if the snapshot is behind the change log
+
+        Args:
+            position: the id of the newest change this process has seen
+            epoch: the epoch of the change log
+        """
+        manifest = self.manifest()
+        if manifest is not None and (manifest.get('change', 0) < position or
+                                     manifest.get('epoch') != epoch):
+            self.markDirty()
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            time.sleep(self.delay)
+            with self.condition:
+                self.pending = False
+            # A replica that lags behind only leaves the manifest at an
+            # older change, and the snapshot is refreshed again later
+            session = self.session_factory()
+            try:
+                self.refresh(session)
+                failed = False
+            except Exception:
+                log.exception('Refreshing the catalog snapshot failed, '
+                              'trying again in %ds', self.retry)
+                failed = True
+            finally:
+                session.close()
+            if failed:
+                time.sleep(self.retry)
+                self.markDirty()
+
+    def refresh(self, session, full=False):
+        """ Brings the snapshot up to date with the change log
+
+        Only the segments of the categories written to since the change
+        log position of the current snapshot are rebuilt, unless the log
+        no longer goes back that far or its epoch was replaced.
+
+        Args:
+            session: the database session to read with
+            full: True to rebuild every segment
+
+        Returns:
+            The manifest of the new snapshot, or of the current one when
+            it is already up to date
+        """
+        with open(os.path.join(self.directory, 'snapshot.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                position, epoch = logPosition(session)
+                manifest = self.manifest()
+                category_ids = None
+                if not full and manifest is not None and \
+                        manifest.get('epoch') == epoch:
+                    if manifest.get('change', 0) >= position:
+                        return manifest
+                    category_ids = changedCategories(
+                        session, manifest.get('change', 0))
+                self.writeSegments(session, category_ids)
+                return self.assemble(session, position, epoch)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def writeSegments(self, session, category_ids=None):
+        """ Writes the segment files of some categories from the database
+
+        Segments of categories that no longer exist are removed.
+
+        Args:
+            session: the database session to read with
+            category_ids: the categories to write, or None for all
+        """
+        found = set()
+        for category_id, name, items in iterCatalogRows(
+                session, category_ids=category_ids):
+            found.add(category_id)
+            writeFile(self.segmentPath(category_id, 'json'),
+                      [serializeCategory(category_id, name, items)])
+            if self.use_msgpack:
+                writeFile(self.segmentPath(category_id, 'msgpack'),
+                          [packCategory(category_id, name, items)])
+        if category_ids is None:
+            stale = [path for path in
+                     glob.glob(os.path.join(self.segmentDirectory(), '*.*'))
+                     if int(os.path.basename(path).split('.')[0])
+                     not in found]
+        else:
+            stale = [self.segmentPath(category_id, extension)
+                     for category_id in set(category_ids) - found
+                     for extension in self.formats()]
+        for path in stale:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def assemble(self, session, position, epoch):
+        """ Joins the segments into the next version of the snapshot
+
+        Args:
+            session: the database session to list the categories with
+            position: the id of the newest change the segments include
+            epoch: the epoch of the change log
+
+        Returns:
+            The manifest of the new snapshot
+        """
+        category_ids = [category_id for category_id, in
+                        session.query(Category.id).order_by(Category.id)]
+        missing = [category_id for category_id in category_ids
+                   if not all(os.path.exists(self.segmentPath(
+                       category_id, extension))
+                       for extension in self.formats())]
+        if missing:
+            self.writeSegments(session, missing)
+        previous = self.manifest()
+        version = previous['version'] + 1 if previous else 1
+        files = {}
+        for extension in self.formats():
+            name = 'catalog-%d.%s' % (version, extension)
+            writeFile(os.path.join(self.directory, name),
+                      self.snapshotChunks(extension, category_ids))
+            files[extension] = {'name': name, 'encoded': {}}
+            for encoding in encodings():
+                encoded = '%s.%s' % (name, 'br' if encoding == 'br'
+                                     else 'gz')
+                writeFile(os.path.join(self.directory, encoded),
+                          compressChunks(
+                              self.snapshotChunks(extension, category_ids),
+                              encoding, 5 if encoding == 'br' else 6))
+                files[extension]['encoded'][encoding] = encoded
+        manifest = {'version': version, 'generated': time.time(),
+                    'change': position, 'epoch': epoch,
+                    'categories': len(category_ids), 'files': files}
+        writeFile(os.path.join(self.directory, 'manifest.json'),
+                  [json.dumps(manifest)])
+        self.removeOldVersions(version)
+        return manifest
+
+    def snapshotChunks(self, extension, category_ids):
+        """ Reads the segments of a snapshot in order, with the framing """
+        if extension == 'json':
+            yield '{"category":['
+        else:
+            packer = msgpack.Packer(use_bin_type=False)
+            yield packer.pack_map_header(1) + packer.pack('category') + \
+                packer.pack_array_header(len(category_ids))
+        for index, category_id in enumerate(category_ids):
+            if extension == 'json' and index:
+                yield ','
+            with open(self.segmentPath(category_id, extension),
+                      'rb') as segment:
+                yield segment.read()
+        if extension == 'json':
+            yield ']}\n'
+
+    def removeOldVersions(self, version):
+        for path in glob.glob(os.path.join(self.directory, 'catalog-*')):
+            number = os.path.basename(path).split('.')[0].split('-')[1]
+            if int(number) <= version - self.keep:
+                os.remove(path)
+
+    def send(self, extension='json'):
+        """ Sends the current snapshot in the best encoding the client takes
+
+        Args:
+            extension: 'json' or 'msgpack'
+
+        Returns:
+            A response, or None when there is no snapshot to send
+        """
+        manifest = self.manifest()
+        if manifest is None or extension not in manifest['files']:
+            return None
+        entry = manifest['files'][extension]
+        encoding = negotiate([encoding for encoding in encodings()
+                              if encoding in entry['encoded']])
+        name = entry['encoded'][encoding] if encoding else entry['name']
+        path = os.path.join(self.directory, name)
+        try:
+            response = send_file(path, mimetype=MIMETYPES[extension],
+                                 add_etags=False, cache_timeout=0)
+            size = os.path.getsize(path)
+        except (IOError, OSError):
+            return None
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag('snapshot-%d-%s' % (manifest['version'],
+                                              encoding or 'identity'))
+        response.last_modified = manifest['generated']
+        response.cache_control.no_cache = True
+        response.headers['X-Snapshot-Version'] = str(manifest['version'])
+        return response.make_conditional(request, accept_ranges=True,
+                                         complete_length=size)
+
+    def check(self, session):
+        """ Compares the snapshot with what Category.serialize produces
+
+        Args:
+            session: the database session to read with
+
+        Returns:
+            A list of problems, empty when the snapshot is correct
+        """
+        manifest = self.manifest()
+        if manifest is None:
+            return ['there is no snapshot']
+        categories = session.query(Category).order_by(Category.id).all()
+        expected = json.dumps({'category': [category.serialize
+                                            for category in categories]},
+                              separators=(',', ':')) + '\n'
+        files = manifest['files']
+        problems = []
+        with open(os.path.join(self.directory,
+                               files['json']['name']), 'rb') as snapshot:
+            actual = snapshot.read()
+        if actual != expected:
+            document = json.loads(actual)['category']
+            stored = dict((category['category_id'], category)
+                          for category in document)
+            for category in categories:
+                if stored.pop(category.id, None) != json.loads(
+                        json.dumps(category.serialize)):
+                    problems.append('category %d differs' % category.id)
+            problems.extend('category %d no longer exists' % category_id
+                            for category_id in sorted(stored))
+            if not problems:
+                problems.append('the JSON is not byte for byte the same')
+        if 'msgpack' in files and msgpack is not None:
+            with open(os.path.join(self.directory,
+                                   files['msgpack']['name']), 'rb') as packed:
+                decoded = msgpack.unpackb(packed.read(), raw=False)
+            if decoded != json.loads(expected):
+                problems.append('the MessagePack snapshot differs')
+        return problems
+
+
+def packCategory(category_id, category_name, items):
+    """ Encodes one category as MessagePack, shaped like Category.serialize """
+    return msgpack.packb({'category_id': category_id,
+                          'category_name': category_name,
+                          'category_items': items}, use_bin_type=False)
+
+
+def writeFile(path, chunks):
+    """ Writes a file under a temporary name and moves it into place
+
+    Readers see either the old file or the whole new one, never a part.
+    """
+    directory, name = os.path.split(path)
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.' + name)
+    try:
+        with os.fdopen(descriptor, 'wb') as output:
+            for chunk in chunks:
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode('utf-8')
+                output.write(chunk)
+        os.rename(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+if __name__ == '__main__':
+    from sqlalchemy.orm import sessionmaker
+    from db import createEngine
+    parser = argparse.ArgumentParser(description='Build the catalog snapshot')
+    parser.add_argument('--dir', default=os.environ.get('SNAPSHOT_DIR'),
+                        help='the snapshot directory, defaults to '
+                        'SNAPSHOT_DIR')
+    parser.add_argument('--database', help='defaults to DATABASE_URL')
+    parser.add_argument('--no-msgpack', action='store_true',
+                        help='only write the JSON snapshot')
+    parser.add_argument('--check', action='store_true',
+                        help='only compare the snapshot with the database')
+    args = parser.parse_args()
+    if not args.dir:
+        parser.error('--dir or SNAPSHOT_DIR is required')
+
+    session = sessionmaker(bind=createEngine(args.database))()
+    snapshot = CatalogSnapshot(args.dir, use_msgpack=not args.no_msgpack)
+    if not args.check:
+        if not os.path.isdir(snapshot.segmentDirectory()):
+            os.makedirs(snapshot.segmentDirectory())
+        started = time.time()
+        manifest = snapshot.refresh(session, full=True)
+        print 'wrote snapshot version %d of %d categories in %.2fs' % (
+            manifest['version'], manifest['categories'],
+            time.time() - started)
+    problems = snapshot.check(session)
+    for problem in problems:
+        print problem
+    if problems:
+        sys.exit(1)
+    print 'snapshot matches the database'
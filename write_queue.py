@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+import logging
+import os
+import threading
+import time
+from Queue import Empty, Queue
+from concurrent.futures import Future
+
+log = logging.getLogger('catalog.write_queue')
+
+
+class WriteQueue(object):
+    """ Funnels writes through one thread that commits them in groups
+
+    A write is a function that takes a session, makes its changes without
+    committing and returns a result. The writer thread takes the first
+    write waiting, then whatever else arrives within window seconds, up to
+    max_batch writes, and runs them all in one transaction. Each write gets
+    its own SAVEPOINT, so one that raises is rolled back on its own and its
+    caller gets the exception while the others still commit. If the commit
+    itself fails, the writes of the group are run again one transaction
+    each, so a single bad write cannot fail its neighbours.
+
+    The sessions commit without expiring their objects, so what a write
+    returns can still be read once it is handed back to the request.
+    """
+
+    def __init__(self, window=0.002, max_batch=64):
+        self.window = window
+        self.max_batch = max_batch
+        self.session_factory = None
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.jobs = None
+        self.thread = None
+        self.pid = None
+        self.batches = 0
+        self.writes = 0
+        self.largest = 0
+
+    def start(self, session_factory):
+        """ Turns the queue on; the thread starts with the first write
+
+        Args:
+            session_factory: the sessionmaker of the catalog database
+        """
+        self.session_factory = session_factory
+        self.enabled = True
+
+    def ensureThread(self):
+        """ Starts the writer thread of this process if it is not running
+
+        A forked worker does not inherit the thread, so each process
+        starts its own.
+        """
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.jobs = Queue()
+            self.thread = threading.Thread(target=self.run,
+                                           name='catalog-writer')
+            self.thread.daemon = True
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def submit(self, work):
+        """ Runs a write on the writer thread and waits for it to commit
+
+        Args:
+            work: a function taking a session and returning a result
+
+        Returns:
+            What work returned, once its transaction has committed; an
+            exception raised by work or by the commit is raised here
+        """
+        self.ensureThread()
+        future = Future()
+        self.jobs.put((work, future))
+        return future.result()
+
+    def run(self):
+        while True:
+            batch = [self.jobs.get()]
+            deadline = time.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                try:
+                    if remaining > 0:
+                        batch.append(self.jobs.get(timeout=remaining))
+                    else:
+                        batch.append(self.jobs.get_nowait())
+                except Empty:
+                    break
+            try:
+                self.commit(batch)
+            except Exception as error:
+                log.exception('write group failed')
+                for work, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def commit(self, batch):
+        """ Runs a group of writes in one transaction and settles them
+
+        Args:
+            batch: a list of (work, Future) tuples
+        """
+        session = self.session_factory(expire_on_commit=False)
+        session.info['writer'] = True
+        outcomes = []
+        try:
+            for work, future in batch:
+                savepoint = session.begin_nested()
+                try:
+                    result = work(session)
+                    savepoint.commit()
+                except Exception as error:
+                    savepoint.rollback()
+                    outcomes.append((future, None, error))
+                else:
+                    outcomes.append((future, result, None))
+            session.commit()
+        except Exception as error:
+            session.rollback()
+            if len(batch) > 1:
+                log.warning('group of %d writes failed to commit, retrying '
+                            'them one by one: %s', len(batch), error)
+                for job in batch:
+                    self.commit([job])
+                return
+            outcomes = [(batch[0][1], None, error)]
+        finally:
+            session.close()
+        self.batches += 1
+        self.writes += len(batch)
+        self.largest = max(self.largest, len(batch))
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stats(self):
+        """ Gets how many groups and writes have been committed
+
+        Returns:
+            A dict of the counters
+        """
+        return {'enabled': self.enabled,
+                'window': self.window,
+                'max_batch': self.max_batch,
+                'waiting': self.jobs.qsize() if self.jobs is not None else 0,
+                'batches': self.batches,
+                'writes': self.writes,
+                'largest_batch': self.largest}
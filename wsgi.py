@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+# The entry point for WSGI servers, e.g.
+#   gunicorn -c gunicorn.conf.py wsgi:application
+from application import create_app
+
+application = create_app()